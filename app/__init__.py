@@ -4,14 +4,46 @@ from config import Config
 
 from app.extensions import db, migrate, login_manager, mail, admin
 
-from app.models import Person, User, Post, Tag, post_tags, UserRole, PostStatus, FileStatus
+from app.models import Person, User, Post, Tag, post_tags, UserRole, PostStatus, FileStatus, FilePreviewStatus
     
 def create_app(config_class = Config):
     app = Flask(__name__)
     
     app.config.from_object(config_class)
     
+    if app.config["PROXY_FIX_X_FOR"] or app.config["PROXY_FIX_X_PROTO"]:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_FIX_X_FOR"], x_proto=app.config["PROXY_FIX_X_PROTO"])
+    
     db.init_app(app)
+    
+    from app.query_budget import init_query_budget
+    init_query_budget(app)
+    
+    from app.passwords import init_password_hasher
+    init_password_hasher(app)
+    
+    from app.throttle import init_throttle
+    init_throttle(app)
+    
+    from app.cache import init_cache, init_file_cache
+    init_cache(app)
+    init_file_cache(app)
+    
+    from app.user_cache import init_user_cache
+    init_user_cache(app)
+    
+    from app.storage import init_storage
+    init_storage(app)
+    
+    from app.sweeper import init_storage_sweeper
+    init_storage_sweeper(app)
+    
+    from app.main.events import init_event_broker
+    init_event_broker(app)
+    
+    from app.previews import init_preview_worker
+    init_preview_worker(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
     mail.init_app(app)
@@ -23,11 +55,11 @@ def create_app(config_class = Config):
 
     @app.errorhandler(404)
     def error404(e):
-        return render_template("404.html")
+        return render_template("404.html"), 404
     
     @app.context_processor
     def inject_enums():
-        return dict(UserRole=UserRole, FileStatus=FileStatus, PostStatus=PostStatus)
+        return dict(UserRole=UserRole, FileStatus=FileStatus, PostStatus=PostStatus, FilePreviewStatus=FilePreviewStatus)
     
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
@@ -1,11 +1,16 @@
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.filters import BaseSQLAFilter, IntGreaterFilter, IntSmallerFilter
+from sqlalchemy import select, func, cast, BigInteger
+from sqlalchemy.orm import joinedload, with_expression
 from app.extensions import db, admin
-from app.models import User, Person, Post, Tag, File, UserRole
+from app.models import User, Person, Post, Tag, File, UserRole, OutboxMessage
 from flask import redirect, url_for
 from flask_login import current_user
 from wtforms import PasswordField
-from werkzeug.security import generate_password_hash
+from app.passwords import hash_password
 from werkzeug.utils import secure_filename
+from app.main.search import admin_search_criterion
+from app.admin.exports import StreamingExportMixin
 
 class AdminModelView(ModelView):
     def is_accessible(self):
@@ -35,14 +40,86 @@ class SuperAdminModelView(ModelView):
     # column_display_pk = True
 
 
-class UserModelView(SuperAdminModelView):
-    column_exclude_list = ["password_hash"]
+file_stats = (
+    select(
+        File.user_id,
+        func.count(File.id).label("file_count"),
+        func.sum(func.coalesce(File.charged_size, File.size, 0)).label("file_bytes"),
+    )
+    .group_by(File.user_id)
+    .subquery("file_stats")
+)
+post_stats = select(Post.user_id, func.count(Post.id).label("post_count")).group_by(Post.user_id).subquery("post_stats")
+
+# "Space Used" and "Quota Used" both come from the charged file sizes, so the two columns always agree;
+# the quota is widened to bigint first, quota * 1 MiB overflows int4 from 2048 MB up
+USER_STATS = {
+    "file_count": func.coalesce(file_stats.c.file_count, 0),
+    "file_bytes": func.coalesce(file_stats.c.file_bytes, 0),
+    "post_count": func.coalesce(post_stats.c.post_count, 0),
+    "quota_used": func.coalesce(file_stats.c.file_bytes, 0) * 100.0 / func.nullif(cast(User.quota, BigInteger) * 1024 * 1024, 0),
+}
+
+class QuotaUsedFilter(BaseSQLAFilter):
+    def apply(self, query, value, alias=None):
+        return query.filter(USER_STATS["quota_used"] >= float(value))
+
+    def operation(self):
+        return "at least (%)"
+
+    def validate(self, value):
+        try:
+            float(value)
+        except ValueError:
+            return False
+        return True
+
+def user_stats_filters():
+    return [
+        QuotaUsedFilter(User.bytes_used, "Quota Used"),
+        IntGreaterFilter(USER_STATS["file_count"], "Files"),
+        IntSmallerFilter(USER_STATS["file_count"], "Files"),
+        IntGreaterFilter(USER_STATS["post_count"], "Posts"),
+        IntSmallerFilter(USER_STATS["post_count"], "Posts"),
+    ]
+
+# Per-user file and post totals come from two grouped subqueries joined into the list (and count)
+# query, so they cost one query per page and can be sorted and filtered in SQL.
+class UserStatsMixin:
+    column_list = ["person", "email", "email_confirmed", "first_name", "last_name", "ldap_group", "role", "quota", "file_bytes", "quota_used", "file_count", "post_count", "reputation", "force_password_change"]
+    
+    def with_user_stats(self, query):
+        return query.outerjoin(file_stats, file_stats.c.user_id == User.id).outerjoin(post_stats, post_stats.c.user_id == User.id)
+    
+    def get_query(self):
+        return self.with_user_stats(super().get_query()).options(
+            joinedload(User.person),
+            *[with_expression(getattr(User, name), expression) for name, expression in USER_STATS.items()],
+        )
+    
+    def get_count_query(self):
+        return self.with_user_stats(super().get_count_query())
+    
+    def scaffold_sortable_columns(self):
+        columns = super().scaffold_sortable_columns()
+        columns.update(USER_STATS)
+        return columns
+
+USER_STATS_FORMATTERS = {
+    "bytes_used": lambda v, c, m, p: f"{round(m.bytes_used / (1024*1024), 2)} MB",
+    "file_bytes": lambda v, c, m, p: f"{round((m.file_bytes or 0) / (1024*1024), 2)} MB",
+    "quota_used": lambda v, c, m, p: f"{round(m.quota_used or 0, 1)}%",
+}
+
+USER_STATS_LABELS = {"file_bytes": "Space Used", "quota_used": "Quota Used", "file_count": "Files", "post_count": "Posts"}
+
+class UserModelView(UserStatsMixin, StreamingExportMixin, SuperAdminModelView):
+    column_exclude_list = ["password_hash", "version"]
+    column_export_exclude_list = ["password_hash", "version"]
     column_searchable_list = ["first_name", "last_name", "email", "ldap_group"]
-    column_filters = ["ldap_group", "role"]
+    column_filters = ["ldap_group", "role", *user_stats_filters()]
     
-    column_formatters = {
-        "space_used": lambda v, c, m, p: f"{round(m.space_used / (1024*1024), 2)} MB"
-    }
+    column_formatters = USER_STATS_FORMATTERS
     create_modal = True
     edit_modal = True
     
@@ -59,21 +136,21 @@ class UserModelView(SuperAdminModelView):
     }
     def on_model_change(self, form, model, is_created):
         if hasattr(form, "password") and form.password.data:
-            model.password_hash = generate_password_hash(form.password.data)
+            model.password_hash = hash_password(form.password.data)
     
-    can_export = True
-    export_types = ["csv", "xlsx", "json"]
     
     column_editable_list = ["reputation"]
-    form_excluded_columns = ["password_hash"]
+    form_excluded_columns = ["password_hash", "bytes_used", "version", "digest_subscription", "file_count", "file_bytes", "post_count", "quota_used"]
     
-    column_labels = {"ldap_group" : "Group", "first_name" : "First Name", "last_name" : "Last Name", "email" : "Email"}
+    column_labels = {"ldap_group" : "Group", "first_name" : "First Name", "last_name" : "Last Name", "email" : "Email", **USER_STATS_LABELS}
     
-class BasicUserModelView(AdminOnlyModelView):
-    column_exclude_list = ["password_hash"]
+class BasicUserModelView(UserStatsMixin, AdminOnlyModelView):
+    column_exclude_list = ["password_hash", "version"]
+    column_export_exclude_list = ["password_hash", "version"]
     column_searchable_list = ["first_name", "last_name", "email", "ldap_group"]
-    column_filters = ["ldap_group", "role"]
+    column_filters = ["ldap_group", "role", *user_stats_filters()]
     
+    column_formatters = USER_STATS_FORMATTERS
     create_modal = True
     edit_modal = True
     
@@ -90,14 +167,14 @@ class BasicUserModelView(AdminOnlyModelView):
     }
     def on_model_change(self, form, model, is_created):
         if form.password.data:
-            model.password_hash = generate_password_hash(form.password.data)
+            model.password_hash = hash_password(form.password.data)
             
     can_delete = False
     can_create = False
     column_editable_list = ["reputation"]
     form_columns = ["reputation", "quota"]
     
-    column_labels = {"ldap_group" : "Group", "first_name" : "First Name", "last_name" : "Last Name", "email" : "Email"}
+    column_labels = {"ldap_group" : "Group", "first_name" : "First Name", "last_name" : "Last Name", "email" : "Email", **USER_STATS_LABELS}
     
 
 from flask_admin.contrib.fileadmin import FileAdmin
@@ -110,7 +187,7 @@ class StaticFilesView(FileAdmin):
     def inaccessible_callback(self, name, **kwargs):
         return redirect(url_for("auth.signin"))
 
-class PersonModelView(SuperAdminModelView):
+class PersonModelView(StreamingExportMixin, SuperAdminModelView):
     column_searchable_list = ["first_name", "last_name", "login", "ldap_group"]
     column_filters = ["ldap_group"]
     
@@ -119,14 +196,15 @@ class PersonModelView(SuperAdminModelView):
     
     page_size = 50
     
-    can_export = True
-    export_types = ["csv", "xlsx", "json"]
     
     column_labels = {"ldap_group" : "Group", "first_name" : "First Name", "last_name" : "Last Name", "login" : "Login"}
     
-class PostModelView(AdminModelView):
+class PostModelView(StreamingExportMixin, AdminModelView):
     column_searchable_list = ["title", "content", "author.first_name", "author.last_name"]
     column_filters = ["author", "status"]
+    column_exclude_list = ["rendered_html", "renderer_version"]
+    column_export_exclude_list = ["rendered_html", "renderer_version"]
+    form_excluded_columns = ["rendered_html", "renderer_version", "published_at"]
     
     create_modal = True
     edit_modal = True
@@ -142,7 +220,6 @@ class PostModelView(AdminModelView):
     @property
     def can_export(self):
         return current_user.role == UserRole.superadmin
-    export_types = ["csv", "xlsx", "json"]
     
     column_formatters = {
         "created_at": lambda v, c, m, p: m.created_at.strftime("%Y-%m-%d %H:%M")
@@ -151,6 +228,14 @@ class PostModelView(AdminModelView):
     column_editable_list = ["status"]
     column_labels = {"title" : "Title", "content" : "Content", "author.first_name" : "Author's First Name", "author.last_name" : "Author's Last Name"}
     
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        criterion = admin_search_criterion(search)
+        if criterion is None:
+            return query, count_query, joins, count_joins
+        if count_query is not None:
+            count_query = count_query.filter(criterion)
+        return query.filter(criterion), count_query, joins, count_joins
+    
 class PendingPostModelView(PostModelView):
     def get_query(self):
         return super().get_query().filter(self.model.status == "pending").order_by(self.model.created_at.asc())
@@ -165,27 +250,25 @@ class RecentPostModelView(PostModelView):
     def get_count_query(self):
         return super().get_count_query().filter(self.model.status == "visible")
     
-class TagModelView(AdminModelView):
+class TagModelView(StreamingExportMixin, AdminModelView):
     create_modal = True
     edit_modal = True
 
     @property
     def can_export(self):
         return current_user.role == UserRole.superadmin
-    export_types = ["csv", "xlsx", "json"]
     
     column_labels = {"title" : "Title", "content" : "Content", "author.first_name" : "Author's First Name", "author.last_name" : "Author's Last Name"}
 
 from markupsafe import Markup
 
-class FileModelView(AdminModelView):
+class FileModelView(StreamingExportMixin, AdminModelView):
     create_modal = True
     edit_modal = True
     
     @property
     def can_export(self):
         return current_user.role == UserRole.superadmin
-    export_types = ["csv", "xlsx", "json"]
     
     column_formatters = {
         "created_at": lambda v, c, m, p: m.created_at.strftime("%Y-%m-%d %H:%M"),
@@ -195,6 +278,8 @@ class FileModelView(AdminModelView):
     }
     
     column_editable_list = ["status"]
+    column_exclude_list = ["preview"]
+    form_excluded_columns = ["blob", "charged_size", "preview", "preview_status"]
     
 class PendingFileModelView(FileModelView):
     def get_query(self):
@@ -210,15 +295,38 @@ class RecentFileModelView(FileModelView):
     def get_count_query(self):
         return super().get_count_query().filter(self.model.status == "visible")
     
-class UserFilesView(FileAdmin):
+class OutboxModelView(SuperAdminModelView):
+    can_create = False
+    can_edit = False
+    column_list = ["subject", "recipients", "status", "attempts", "last_error", "next_attempt_at", "created_at", "sent_at"]
+    column_filters = ["status"]
+    column_default_sort = ("id", True)
+    
+class UserFilesAccessMixin:
     def is_accessible(self):
         return current_user.is_authenticated and (current_user.role == UserRole.superadmin or current_user.role == UserRole.admin)
 
     def inaccessible_callback(self, name, **kwargs):
         return redirect(url_for("auth.signin"))
 
+class UserFilesView(UserFilesAccessMixin, FileAdmin):
+    pass
+
+def user_files_view(storage, **kwargs):
+    if isinstance(storage, S3Storage):
+        from flask_admin.contrib.fileadmin.s3 import S3FileAdmin
+
+        class S3UserFilesView(UserFilesAccessMixin, S3FileAdmin):
+            pass
+
+        return S3UserFilesView(storage.client, storage.bucket, **kwargs)
+    # the sharded layout no longer matches /uploads/<filename>, so files are downloaded through the admin view itself
+    return UserFilesView(storage.root, **kwargs)
+
 
+import os
 import os.path as op
+from app.storage import get_storage, S3Storage
 from flask_admin.base import MenuLink
 def init_admin():
     admin.add_view(UserModelView(User, db.session, name="Users"))
@@ -231,7 +339,8 @@ def init_admin():
     admin.add_view(FileModelView(File, db.session, name="All", category="Files"))
     admin.add_view(PendingFileModelView(File, db.session, name="Pending", endpoint="pending_files", category="Files"))
     admin.add_view(RecentFileModelView(File, db.session, name="Recent", endpoint="recent_files", category="Files"))
-    admin.add_view(UserFilesView(op.join(op.dirname(__file__), "..", "uploads"), "/uploads/", name="Uploads"))
+    admin.add_view(user_files_view(get_storage(), name="Uploads"))
+    admin.add_view(OutboxModelView(OutboxMessage, db.session, name="Outbox"))
     admin.add_view(StaticFilesView(op.join(op.dirname(__file__), "..", "static"), "/static/", name="Static Files"))
     
     admin.add_link(MenuLink(name="Logout", url="/auth/logout"))
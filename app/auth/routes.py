@@ -1,6 +1,7 @@
 from flask import render_template, request, flash, redirect, url_for, current_app
 from flask_login import login_user, current_user, logout_user, login_required
-from werkzeug.security import check_password_hash, generate_password_hash
+from app.passwords import hash_password, check_password, needs_rehash
+from app.throttle import throttle_wait, throttled_response
 from itsdangerous import URLSafeTimedSerializer
 from app.extensions import db
 from app.mail import send_button_message
@@ -19,10 +20,18 @@ def signin():
         if not email or not password:
             flash("Wypełnij wszystkie wymagane pola!", category="error")
             return render_template("signin.html")
+        wait = throttle_wait("signin", email)
+        if wait:
+            return throttled_response("signin.html", wait)
         user = User.query.filter_by(email=email).first()
-        if not user or not check_password_hash(user.password_hash, password):
+        if not user or not check_password(user.password_hash, password):
             flash("Niepoprawy email i/lub hasło!", category="error")
+        elif user.person is not None and user.person.left_at is not None:
+            flash("Konto szkolne powiązane z tym kontem zostało usunięte z systemu szkolnego.", category="error")
         else:
+            if needs_rehash(user.password_hash):
+                user.password_hash = hash_password(password)
+                db.session.commit()
             login_user(user)
             return redirect(url_for("panel.panel_home"))
             
@@ -57,12 +66,15 @@ def signup():
         return redirect(url_for("panel.panel_home"))
     if request.method == "POST":
         mode = request.form.get("mode")
+        wait = throttle_wait("signup", request.form.get("login"))
+        if wait:
+            return throttled_response("signup.html", wait)
         if mode == "start":
             login = request.form.get("login")
             if not login:
                 flash("Pole login jest wymagane!", "error")
                 return render_template("signup.html")
-            person = Person.query.filter_by(login=login).first()
+            person = Person.query.filter_by(login=login, left_at=None).first()
             if not person:
                 flash("Nie znaleziono w systemie szkolnym konta o podanym loginie!", "error")
                 return render_template("signup.html")
@@ -71,6 +83,7 @@ def signup():
                 flash("Z tym kontem szkolnym jest już powiązane konto!", "error")
                 return redirect(url_for("auth.signin"))
             send_button_message("Rejestracja w systemie ITOS", "Aby kontunuować rejestrację w systemie ITOS, kliknij w poniższy link i potwierdź swoją tożsamość.", [login+"@staszic.waw.pl"], "Potwierdź", url_for("auth.confirm_signup", token=generate_token(login), _external=True))
+            db.session.commit()
             return render_template("confirmation-mail-sent.html", login=login)
         elif mode == "confirm":
             email = request.form.get("email")
@@ -93,13 +106,16 @@ def signup():
                 flash("Wprowadź poprawny adres email!", "error")
                 return redirect(url_for("auth.confirm_signup", token=token))
             login = confirm_token(token)
-            person = Person.query.filter_by(login=login).first()
+            person = Person.query.filter_by(login=login, left_at=None).first() if login else None
+            if not person:
+                flash("Twój link wygasł lub jest niewżany!", "error")
+                return redirect(url_for("auth.signup"))
             email_confirmed = False
             if(email == login+"@staszic.waw.pl"):
                 email_confirmed = True
             else:
-                send_button_message("Potwierdzenie adresu email w systemie ITOS", "Aby potwierdzić adres email w systemie ITOS, kliknij poniższy przycisk.", [current_user.email], "Potwierdź", url_for("auth.confirm_email", token=generate_token(current_user.email), _external=True))
-            user = User(first_name=person.first_name, last_name=person.last_name, email=email, ldap_group=person.ldap_group, person=person, password_hash=generate_password_hash(password), email_confirmed=email_confirmed)
+                send_button_message("Potwierdzenie adresu email w systemie ITOS", "Aby potwierdzić adres email w systemie ITOS, kliknij poniższy przycisk.", [email], "Potwierdź", url_for("auth.confirm_email", token=generate_token(email), _external=True))
+            user = User(first_name=person.first_name, last_name=person.last_name, email=email, ldap_group=person.ldap_group, person=person, password_hash=hash_password(password), email_confirmed=email_confirmed)
             db.session.add(user)
             db.session.commit()
             flash("Rejestracja przebiegła pomyślnie!", "success")
@@ -118,10 +134,13 @@ def confirm_signup(token):
     if not login:
         flash("Twój link wygasł lub jest niewżany!", "error")
         return redirect(url_for("auth.signup"))
-    if User.query.filter_by(person_id=Person.query.filter_by(login=login).first().id).first():
+    person = Person.query.filter_by(login=login, left_at=None).first()
+    if not person:
+        flash("Nie znaleziono w systemie szkolnym konta o podanym loginie!", "error")
+        return redirect(url_for("auth.signup"))
+    if User.query.filter_by(person_id=person.id).first():
         flash("Z tym kontem szkolnym jest już powiązane konto!", "error")
         return redirect(url_for("auth.signin"))
-    person = Person.query.filter_by(login=login).first()
     return render_template("confirm-signup.html", person=person, token=token)
     
 
@@ -148,6 +167,7 @@ def confirm_email(token):
 def resend_confirmation_email():
     if not current_user.email_confirmed:
         send_button_message("Potwierdzenie adresu email w systemie ITOS", "Aby potwierdzić adres email w systemie ITOS, kliknij poniższy przycisk.", [current_user.email], "Potwierdź", url_for("auth.confirm_email", token=generate_token(current_user.email), _external=True))
+        db.session.commit()
         flash("Wiadomość została wysłana ponownie!", "success")
     return redirect(url_for("panel.panel_home"))
 
@@ -162,11 +182,16 @@ def request_password_reset():
         if not email or not is_valid_email(email):
             flash("Wpisz prawidłowy adres email!", "error")
             return render_template("request-password-reset.html")
+        
+        wait = throttle_wait("reset-password", email)
+        if wait:
+            return throttled_response("request-password-reset.html", wait)
 
         user = User.query.filter_by(email=email).first()
         
         if user:
             send_button_message("Zmiana hasła w systemie ITOS", "Aby zmienić hasło do konta w systemie ITOS, kliknij poniższy przycisk.", [email], "Zmień hasło", url_for("auth.reset_password", token=generate_token(email), _external=True))
+            db.session.commit()
     
         flash("Jeśli konto o takim adresie email istnieje, wiadomość została wysłana.", "success")
         
@@ -200,8 +225,12 @@ def reset_password(token):
         if password != confirmpassword:
             flash("Podane hasła nie były identyczne!", "error")
             return render_template("reset-password.html", token=token)
+        
+        wait = throttle_wait("reset-password", email)
+        if wait:
+            return throttled_response("reset-password.html", wait, token=token)
             
-        user.password_hash = generate_password_hash(password)
+        user.password_hash = hash_password(password)
         db.session.commit()
         
         flash("Twoje hasło zostało zmienione. Możesz się teraz zalogować.", "success")
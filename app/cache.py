@@ -0,0 +1,120 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from flask import current_app
+from werkzeug.utils import import_string
+
+class MemoryLRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def delete(self, key):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+# Per-process cache of small Python objects with a hard entry limit and a TTL, so
+# changes made by other worker processes show up after at most `ttl` seconds.
+class TTLCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 3) if requests else None,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+            }
+
+# Any object with get(key) -> bytes | None, set(key, bytes, timeout) and delete(key)
+# can be used as a shared backend, e.g. a thin wrapper around a redis or memcached client.
+class FragmentCache:
+    def __init__(self, backend, timeout=None):
+        self.backend = backend
+        self.timeout = timeout
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value):
+        self.backend.set(key, json.dumps(value, separators=(",", ":")).encode(), self.timeout)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+def init_cache(app):
+    backend = app.config.get("BOARD_CACHE_BACKEND", "memory")
+    if backend == "memory":
+        backend = MemoryLRUCache(app.config.get("BOARD_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+    else:
+        backend = import_string(backend)(app)
+    app.extensions["itos_cache"] = FragmentCache(backend, timeout=app.config.get("BOARD_CACHE_TIMEOUT"))
+
+def get_cache():
+    return current_app.extensions["itos_cache"]
+
+def init_file_cache(app):
+    app.extensions["file_cache"] = TTLCache(app.config["FILE_CACHE_SIZE"], app.config["FILE_CACHE_TTL"])
+
+def get_file_cache():
+    return current_app.extensions["file_cache"]
@@ -14,14 +14,15 @@ login_manager.login_message_category = "error"
 
 @login_manager.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    from app.user_cache import load_user_snapshot
+    return load_user_snapshot(int(id))
 
 from flask_mail import Mail
 mail = Mail()
 
-from flask_admin import Admin, AdminIndexView
+from flask_admin import Admin, AdminIndexView, expose
 from flask_admin.theme import Bootstrap4Theme
-from flask import redirect, url_for
+from flask import redirect, url_for, current_app
 
 class ItosIndexView(AdminIndexView):
     def is_accessible(self):
@@ -30,4 +31,8 @@ class ItosIndexView(AdminIndexView):
     def inaccessible_callback(self, name, **kwargs):
         return redirect(url_for("auth.signin"))
     
+    @expose("/")
+    def index(self):
+        return self.render(self._template, file_cache=current_app.extensions["file_cache"].stats(), user_cache=current_app.extensions["user_cache"].stats())
+    
 admin = Admin(name="ITOS Admin", theme=Bootstrap4Theme(swatch="slate"), index_view=ItosIndexView(name="Home"))
\ No newline at end of file
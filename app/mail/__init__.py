@@ -1,11 +1,9 @@
 from flask import render_template
-from flask_mail import Message
-from app.extensions import mail
+from app.mail.outbox import queue_mail
 
+# Messages are only queued here, in the caller's transaction; `manage.py mail-worker` delivers them after it commits.
 def send_message(subject, body, recipients):
-    msg = Message(subject=subject, body=body, html=render_template("mail/message.html", subject=subject, body=body), bcc=recipients)
-    mail.send(msg)
+    queue_mail(subject, body, render_template("mail/message.html", subject=subject, body=body), recipients)
     
 def send_button_message(subject, body, recipients, button_text, button_target):
-    msg = Message(subject=subject, body=f"{body}\nPrzycisk nie działa? Otwórz w przeglądarce następujący adres: {button_target}", html=render_template("mail/button_message.html", subject=subject, body=body, button_text=button_text, button_target=button_target), bcc=recipients)
-    mail.send(msg)
\ No newline at end of file
+    queue_mail(subject, f"{body}\nPrzycisk nie działa? Otwórz w przeglądarce następujący adres: {button_target}", render_template("mail/button_message.html", subject=subject, body=body, button_text=button_text, button_target=button_target), recipients)
\ No newline at end of file
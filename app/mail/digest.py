@@ -0,0 +1,94 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import current_app, render_template, url_for
+from sqlalchemy import select
+
+from app.extensions import db
+from app.models import User, Person, Post, PostStatus, DigestSubscription, DigestFrequency, digest_tags
+from app.main.feed import filter_tags, with_feed_relations
+from app.mail.outbox import queue_mail
+
+DIGEST_PERIODS = {
+    DigestFrequency.daily: timedelta(days=1),
+    DigestFrequency.weekly: timedelta(days=7),
+}
+
+# a cron run that fires a little early still picks up everyone from the previous run
+DIGEST_SLACK = timedelta(hours=1)
+
+def due_subscriptions(frequency, now):
+    cutoff = now - DIGEST_PERIODS[frequency] + DIGEST_SLACK
+    rows = db.session.execute(
+        select(DigestSubscription.id, DigestSubscription.last_sent_at, User.email)
+        .join(User, User.id == DigestSubscription.user_id)
+        .outerjoin(Person, Person.id == User.person_id)
+        .where(
+            DigestSubscription.frequency == frequency,
+            User.email_confirmed == True,
+            # accounts of people who left the school are locked, the same as in UserCache.get
+            Person.left_at == None,
+            (DigestSubscription.last_sent_at == None) | (DigestSubscription.last_sent_at <= cutoff),
+        )
+        .order_by(DigestSubscription.id)
+    ).all()
+    tags = defaultdict(set)
+    for start in range(0, len(rows), 500):
+        ids = [row.id for row in rows[start:start + 500]]
+        for subscription_id, tag_id in db.session.execute(select(digest_tags.c.subscription_id, digest_tags.c.tag_id).where(digest_tags.c.subscription_id.in_(ids))):
+            tags[subscription_id].add(tag_id)
+    return [(row.id, row.email, frozenset(tags[row.id]), row.last_sent_at) for row in rows]
+
+def group_subscriptions(subscriptions, frequency, now):
+    # after the first run everyone on a frequency shares last_sent_at, so this is roughly one group per tag set
+    groups = defaultdict(list)
+    for subscription_id, email, tag_ids, last_sent_at in subscriptions:
+        since = last_sent_at or now - DIGEST_PERIODS[frequency]
+        groups[(tag_ids, since)].append((subscription_id, email))
+    return groups
+
+def digest_posts(tag_ids, since, now, limit):
+    # posts approved after they were written count from the moment they became visible
+    query = Post.query.filter(Post.status == PostStatus.visible, Post.published_at > since, Post.published_at <= now)
+    query = filter_tags(query, sorted(tag_ids))
+    return with_feed_relations(query).order_by(Post.created_at.desc(), Post.id.desc()).limit(limit).all()
+
+def render_digest(frequency, posts):
+    subject = "Nowe ogłoszenia w systemie ITOS"
+    board_url = url_for("main.home", _external=True)
+    profile_url = url_for("panel.profile", _external=True)
+    lines = [f"- {post.title}: {board_url}#post-{post.id}" for post in posts]
+    body = "\n".join([f"Nowe ogłoszenia ({frequency.value}):", *lines, "", f"Ustawienia powiadomień: {profile_url}"])
+    html = render_template("mail/digest.html", subject=subject, posts=posts, frequency=frequency, board_url=board_url, profile_url=profile_url)
+    return subject, body, html
+
+def send_digests(frequency, dry_run=False, now=None):
+    config = current_app.config
+    now = now or datetime.utcnow()
+    bcc_size = config["MAIL_DIGEST_BCC_SIZE"]
+    stats = {"subscriptions": 0, "groups": 0, "empty_groups": 0, "recipients": 0, "messages": 0, "posts": 0}
+
+    groups = group_subscriptions(due_subscriptions(frequency, now), frequency, now)
+    stats["groups"] = len(groups)
+    for (tag_ids, since), members in groups.items():
+        stats["subscriptions"] += len(members)
+        posts = digest_posts(tag_ids, since, now, config["MAIL_DIGEST_MAX_POSTS"])
+        if posts:
+            batches = [members[i:i + bcc_size] for i in range(0, len(members), bcc_size)]
+            stats["recipients"] += len(members)
+            stats["messages"] += len(batches)
+            stats["posts"] += len(posts)
+            if not dry_run:
+                # rendered once for the whole group, then queued as BCC batches the mail worker paces out
+                subject, body, html = render_digest(frequency, posts)
+                for batch in batches:
+                    queue_mail(subject, body, html, [email for _, email in batch])
+        else:
+            stats["empty_groups"] += 1
+        if dry_run:
+            continue
+        ids = [subscription_id for subscription_id, _ in members]
+        db.session.execute(DigestSubscription.__table__.update().where(DigestSubscription.id.in_(ids)).values(last_sent_at=now))
+        db.session.commit()
+    if dry_run:
+        db.session.rollback()
+    return stats
@@ -0,0 +1,128 @@
+import smtplib
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import Message, BadHeaderError
+from sqlalchemy import select, update
+
+from app.extensions import db, mail
+from app.models import OutboxMessage, OutboxStatus
+
+# Rejected by the server for this message only; retrying will not help.
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, BadHeaderError, AssertionError, UnicodeError)
+
+# The message is only added to the session, so it is committed (or rolled back) together with the caller's own changes.
+def queue_mail(subject, body, html, recipients, commit=False):
+    db.session.add(OutboxMessage(subject=subject, body=body, html=html, recipients=list(recipients)))
+    if commit:
+        db.session.commit()
+
+def claim_batch(batch_size, lease):
+    now = datetime.utcnow()
+    ids = db.session.execute(
+        select(OutboxMessage.id)
+        .where(OutboxMessage.status == OutboxStatus.pending, OutboxMessage.next_attempt_at <= now)
+        .order_by(OutboxMessage.next_attempt_at, OutboxMessage.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if ids:
+        db.session.execute(update(OutboxMessage).where(OutboxMessage.id.in_(ids)).values(next_attempt_at=now + timedelta(seconds=lease)))
+    db.session.commit()
+    return OutboxMessage.query.filter(OutboxMessage.id.in_(ids)).order_by(OutboxMessage.id).all() if ids else []
+
+def retry_delay(attempts):
+    config = current_app.config
+    return min(config["MAIL_RETRY_BASE"] * 2 ** (attempts - 1), config["MAIL_RETRY_MAX"])
+
+def record_failure(message, error, permanent=False):
+    message.attempts += 1
+    message.last_error = f"{type(error).__name__}: {error}"[:2000]
+    if permanent or message.attempts >= current_app.config["MAIL_MAX_ATTEMPTS"]:
+        message.status = OutboxStatus.dead
+        current_app.logger.warning("Giving up on outbox message %s: %s", message.id, message.last_error)
+    else:
+        message.next_attempt_at = datetime.utcnow() + timedelta(seconds=retry_delay(message.attempts))
+    db.session.commit()
+
+# Never handed to the server: back off with the batch, but the attempt is not charged to the message.
+def postpone(messages, delay):
+    for message in messages:
+        message.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+    db.session.commit()
+
+def record_sent(message):
+    message.status = OutboxStatus.sent
+    message.sent_at = datetime.utcnow()
+    message.last_error = None
+    db.session.commit()
+
+# With MAIL_SEND_PAUSE a batch can take longer than the lease it was claimed with; renewing it before
+# every message keeps another worker from reclaiming (and sending again) what is still queued here.
+def renew_lease(messages, seconds):
+    ids = [message.id for message in messages]
+    db.session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(ids), OutboxMessage.status == OutboxStatus.pending)
+        .values(next_attempt_at=datetime.utcnow() + timedelta(seconds=seconds))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+def deliver(messages):
+    # mail.connect() reopens the SMTP connection after every MAIL_MAX_EMAILS messages
+    pause = current_app.config["MAIL_SEND_PAUSE"]
+    lease = current_app.config["MAIL_OUTBOX_LEASE"]
+    sent = 0
+    pending = list(messages)
+    try:
+        with mail.connect() as connection:
+            while pending:
+                renew_lease(pending, lease + pause)
+                message = pending[0]
+                try:
+                    connection.send(Message(subject=message.subject, body=message.body, html=message.html, bcc=message.recipients))
+                except PERMANENT_ERRORS as e:
+                    record_failure(message, e, permanent=True)
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError):
+                    raise
+                except smtplib.SMTPResponseException as e:
+                    # the server refused this message only (e.g. its DATA): 5xx is final, 4xx is retried later
+                    record_failure(message, e, permanent=500 <= e.smtp_code < 600)
+                else:
+                    record_sent(message)
+                    sent += 1
+                pending.pop(0)
+                if pause and pending:
+                    time.sleep(pause)
+    except (smtplib.SMTPException, OSError) as e:
+        # the connection itself failed (or QUIT did): the message in flight is charged, the rest just back off
+        if pending:
+            record_failure(pending[0], e)
+            postpone(pending[1:], retry_delay(max(pending[0].attempts, 1)))
+    return sent, len(messages) - sent
+
+def process_outbox():
+    config = current_app.config
+    total_sent = total_failed = 0
+    while True:
+        messages = claim_batch(config["MAIL_OUTBOX_BATCH"], config["MAIL_OUTBOX_LEASE"])
+        if not messages:
+            return total_sent, total_failed
+        sent, failed = deliver(messages)
+        total_sent += sent
+        total_failed += failed
+        if not sent:
+            return total_sent, total_failed
+
+def run_outbox_worker(interval):
+    while True:
+        try:
+            sent, failed = process_outbox()
+            if sent or failed:
+                current_app.logger.info("Outbox: %s sent, %s failed", sent, failed)
+        except Exception:
+            current_app.logger.exception("Processing the mail outbox failed")
+            db.session.rollback()
+        db.session.remove()
+        time.sleep(interval)
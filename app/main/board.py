@@ -0,0 +1,69 @@
+from datetime import datetime
+from flask import render_template
+from sqlalchemy import select
+
+from app.extensions import db
+from app.models import BoardState
+from app.cache import get_cache
+from app.main.feed import board_page, tag_counts
+from app.main.pagination import decode_cursor
+
+def board_state():
+    state = db.session.execute(select(BoardState.version, BoardState.updated_at).where(BoardState.id == 1)).first()
+    if state is None:
+        return 0, None
+    return state.version, state.updated_at
+
+def build_board(tag_ids, match_all, page, after, before):
+    pagination = board_page(tag_ids=tag_ids, match_all=match_all, page=page, after=after, before=before)
+    board = {
+        "posts": [
+            {"id": post.id, "created_at": post.created_at.isoformat(), "html": render_template("board-post.html", post=post)}
+            for post in pagination.items
+        ]
+    }
+    if page:
+        board.update(
+            page=pagination.page,
+            pages=list(pagination.iter_pages(left_edge=1, right_edge=1, left_current=1, right_current=2)),
+            prev_num=pagination.prev_num if pagination.has_prev else None,
+            next_num=pagination.next_num if pagination.has_next else None,
+        )
+    else:
+        board.update(prev_cursor=pagination.prev_cursor, next_cursor=pagination.next_cursor)
+    return board
+
+# Only the post fragments and navigation are cached; the "new" highlighting depends on the
+# reader's last_read cookie and is applied by board.html on every request.
+def get_board(tag_ids=None, match_all=False, page=None, after=None, before=None, version=None):
+    if version is None:
+        version, _ = board_state()
+    if page:
+        after = before = None
+    after = after if decode_cursor(after) else None
+    before = before if decode_cursor(before) else None
+    
+    tags = ",".join(str(id) for id in tag_ids or [])
+    key = f"board:{version}:{tags}:{'all' if match_all else 'any'}:{page or ''}:{after or ''}:{before or ''}"
+    cache = get_cache()
+    board = cache.get(key)
+    if board is None:
+        board = build_board(tag_ids, match_all, page, after, before)
+        cache.set(key, board)
+    
+    for post in board["posts"]:
+        post["created_at"] = datetime.fromisoformat(post["created_at"])
+    return board
+
+# Facet counts only change together with the board, so they are computed once per version.
+def get_tag_facets(version=None):
+    if version is None:
+        version, _ = board_state()
+    
+    key = f"tag-facets:{version}"
+    cache = get_cache()
+    facets = cache.get(key)
+    if facets is None:
+        facets = [{"id": tag.id, "name": tag.name, "color": tag.color.value, "count": count} for tag, count in tag_counts()]
+        cache.set(key, facets)
+    return facets
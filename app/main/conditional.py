@@ -0,0 +1,16 @@
+import hashlib
+from flask import request, make_response
+from werkzeug.http import is_resource_modified
+
+def make_etag(*parts):
+    return hashlib.sha256(":".join(str(part) for part in parts).encode()).hexdigest()
+
+def not_modified(etag, last_modified=None):
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+def not_modified_response(etag, last_modified=None):
+    resp = make_response("", 304)
+    resp.set_etag(etag)
+    if last_modified:
+        resp.last_modified = last_modified
+    return resp
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, func
+
+from app.extensions import db
+from app.models import PostEvent
+
+# One broker per worker process polls post_events and fans new rows out to every
+# connected /events stream, so the database sees one poll per worker, not per client.
+class PostEventBroker:
+    def __init__(self, app):
+        self.app = app
+        self.poll_interval = app.config["SSE_POLL_INTERVAL"]
+        self.retention = timedelta(seconds=app.config["SSE_EVENT_RETENTION"])
+        self.buffer = deque(maxlen=app.config["SSE_BUFFER_SIZE"])
+        self.condition = threading.Condition()
+        self.gap_timeout = app.config["SSE_GAP_TIMEOUT"]
+        self.last_id = None
+        self.blocked_since = None
+        self.last_pruned = 0
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            with self.app.app_context():
+                self.last_id = db.session.execute(select(func.max(PostEvent.id))).scalar() or 0
+                db.session.remove()
+            self.thread = threading.Thread(target=self.run, name="post-event-broker", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                self.app.logger.exception("Polling post events failed")
+            time.sleep(self.poll_interval)
+
+    def poll(self):
+        with self.app.app_context():
+            try:
+                rows = db.session.execute(
+                    select(PostEvent.id, PostEvent.post_id, PostEvent.kind).where(PostEvent.id > self.last_id).order_by(PostEvent.id)
+                ).all()
+                if time.monotonic() - self.last_pruned > 3600:
+                    db.session.execute(delete(PostEvent).where(PostEvent.created_at < datetime.utcnow() - self.retention))
+                    db.session.commit()
+                    self.last_pruned = time.monotonic()
+            finally:
+                db.session.remove()
+
+        rows = self.ready_rows(rows)
+        if rows:
+            with self.condition:
+                for row in rows:
+                    self.buffer.append(event_dict(row))
+                self.last_id = rows[-1].id
+                self.condition.notify_all()
+
+    # Ids are handed out before commit, so a missing id may belong to a transaction that has not
+    # committed yet. Rows past such a gap are held back (and re-read next poll) until the gap fills,
+    # or for SSE_GAP_TIMEOUT seconds, after which the gap is taken to be a rollback.
+    def ready_rows(self, rows):
+        expected = self.last_id + 1
+        for index, row in enumerate(rows):
+            if row.id != expected:
+                now = time.monotonic()
+                if self.blocked_since is None:
+                    self.blocked_since = now
+                if now - self.blocked_since < self.gap_timeout:
+                    return rows[:index]
+                break
+            expected = row.id + 1
+        self.blocked_since = None
+        return rows
+
+    def latest_id(self):
+        self.start()
+        return self.last_id
+
+    def events_after(self, last_id, timeout):
+        self.start()
+        with self.condition:
+            if last_id >= self.last_id:
+                self.condition.wait(timeout)
+            up_to = self.last_id
+            # an empty buffer (e.g. a worker that just restarted) covers nothing before up_to
+            covered = last_id >= up_to or (self.buffer and self.buffer[0]["id"] <= last_id + 1)
+            if covered:
+                events = [e for e in self.buffer if e["id"] > last_id]
+        if not covered:
+            return self.load_events_after(last_id, up_to)
+        return events
+
+    # Last-Event-ID older than the in-memory buffer: catch the client up from the table, but not
+    # past what the poller has released, so rows held back behind a gap are not skipped.
+    def load_events_after(self, last_id, up_to):
+        with self.app.app_context():
+            try:
+                rows = db.session.execute(
+                    select(PostEvent.id, PostEvent.post_id, PostEvent.kind)
+                    .where(PostEvent.id > last_id, PostEvent.id <= up_to)
+                    .order_by(PostEvent.id)
+                    .limit(self.buffer.maxlen)
+                ).all()
+            finally:
+                db.session.remove()
+        return [event_dict(row) for row in rows]
+
+def event_dict(row):
+    return {"id": row.id, "post_id": row.post_id, "kind": row.kind.value}
+
+def init_event_broker(app):
+    app.extensions["post_event_broker"] = PostEventBroker(app)
@@ -0,0 +1,48 @@
+from sqlalchemy import select, func
+from sqlalchemy.orm import joinedload, selectinload
+
+from app.extensions import db
+from app.models import Post, PostStatus, Tag, File, FileStatus, post_tags
+from app.main.pagination import cursor_paginate
+
+def with_feed_relations(query, visible_files_only=True):
+    files = Post.files.and_(File.status == FileStatus.visible) if visible_files_only else Post.files
+    return query.options(
+        joinedload(Post.author),
+        selectinload(Post.tags),
+        selectinload(files),
+    )
+
+def filter_tags(query, tag_ids=None, match_all=False):
+    if not tag_ids:
+        return query
+    tagged = select(post_tags.c.post_id).where(post_tags.c.tag_id.in_(tag_ids))
+    if match_all and len(tag_ids) > 1:
+        tagged = tagged.group_by(post_tags.c.post_id).having(func.count() == len(tag_ids))
+    return query.filter(Post.id.in_(tagged))
+
+def board_query(tag_ids=None, match_all=False):
+    query = filter_tags(Post.query.filter_by(status=PostStatus.visible), tag_ids, match_all)
+    return with_feed_relations(query)
+
+def board_page(tag_ids=None, match_all=False, page=None, after=None, before=None, per_page=10):
+    query = board_query(tag_ids, match_all)
+    if page:
+        return query.order_by(Post.created_at.desc(), Post.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    return cursor_paginate(query, after=after, before=before, per_page=per_page)
+
+def tag_counts():
+    visible = select(Post.id).where(Post.status == PostStatus.visible)
+    count = func.count(post_tags.c.post_id)
+    query = (
+        select(Tag, count)
+        .join(post_tags, post_tags.c.tag_id == Tag.id)
+        .where(post_tags.c.post_id.in_(visible))
+        .group_by(Tag.id)
+        .order_by(count.desc(), Tag.name)
+    )
+    return db.session.execute(query).all()
+
+def user_posts(user_id):
+    query = Post.query.filter_by(user_id=user_id).order_by(Post.created_at.desc(), Post.id.desc())
+    return with_feed_relations(query, visible_files_only=False).all()
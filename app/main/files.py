@@ -0,0 +1,26 @@
+from collections import namedtuple
+from sqlalchemy import select
+
+from app.extensions import db
+from app.models import File
+from app.cache import get_file_cache
+
+# everything main.userfile needs, without building a File instance
+FileRecord = namedtuple("FileRecord", "id name filename status mimetype size created_at key preview preview_status")
+
+def get_file_record(filename):
+    cache = get_file_cache()
+    record = cache.get(filename)
+    if record is not None:
+        return record
+    
+    row = db.session.execute(
+        select(File.id, File.name, File.filename, File.status, File.mimetype, File.size, File.created_at, File.blob_sha256, File.preview, File.preview_status)
+        .where(File.filename == filename)
+    ).first()
+    if row is None:
+        return None
+    
+    record = FileRecord(row.id, row.name, row.filename, row.status, row.mimetype, row.size, row.created_at, row.blob_sha256 or row.filename, row.preview, row.preview_status)
+    cache.set(filename, record)
+    return record
@@ -0,0 +1,69 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+from app.models import Post
+
+def encode_token(values):
+    raw = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_token(token):
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except ValueError:
+        return None
+    return values if isinstance(values, list) else None
+
+def encode_cursor(post):
+    return encode_token([post.created_at.isoformat(), post.id])
+
+def decode_cursor(token):
+    values = decode_token(token)
+    try:
+        created_at, id = values
+        return datetime.fromisoformat(created_at), int(id)
+    except (ValueError, TypeError):
+        return None
+
+class CursorPage:
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+def cursor_paginate(query, after=None, before=None, per_page=10):
+    # keyset pagination on (created_at, id): "after" goes to older posts, "before" back to newer ones
+    after = decode_cursor(after)
+    before = decode_cursor(before) if not after else None
+
+    if before:
+        created_at, id = before
+        query = query.filter(or_(Post.created_at > created_at, and_(Post.created_at == created_at, Post.id > id)))
+        rows = query.order_by(Post.created_at.asc(), Post.id.asc()).limit(per_page + 1).all()
+        more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        prev_cursor = encode_cursor(items[0]) if more else None
+        next_cursor = encode_cursor(items[-1]) if items else None
+        return CursorPage(items, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+    if after:
+        created_at, id = after
+        query = query.filter(or_(Post.created_at < created_at, and_(Post.created_at == created_at, Post.id < id)))
+    rows = query.order_by(Post.created_at.desc(), Post.id.desc()).limit(per_page + 1).all()
+    more = len(rows) > per_page
+    items = rows[:per_page]
+    next_cursor = encode_cursor(items[-1]) if more else None
+    prev_cursor = encode_cursor(items[0]) if after and items else None
+    return CursorPage(items, next_cursor=next_cursor, prev_cursor=prev_cursor)
@@ -1,24 +1,31 @@
-from flask import render_template, url_for, request, redirect, current_app, send_file, abort, make_response
+from flask import render_template, url_for, request, redirect, current_app, abort, make_response, Response
 from flask_login import current_user
 from app.extensions import db
-from app.models import Post, File, PostStatus, FileStatus, Tag, User, UserRole
-import os
+from app.models import FileStatus, FilePreviewStatus, Tag, User, UserRole
+import json
+from urllib.parse import quote
 from datetime import datetime
 
 from app.main import bp
+from app.main.board import get_board, get_tag_facets, board_state
+from app.main.pagination import CursorPage
+from app.main.search import search_posts
+from app.main.syndication import get_feed, FEED_MIMETYPES
+from app.main.conditional import make_etag, not_modified, not_modified_response
+from app.main.sendfile import send_upload
+from app.storage import get_storage
+from app.main.files import get_file_record
+from app.query_budget import query_budget
 
 
 @bp.route("/")
+@query_budget(6)
 def home():
-    tagid = request.args.get("tag", None, type=int)
-    
-    query = Post.query.filter_by(status=PostStatus.visible).order_by(Post.created_at.desc())
-    if tagid:
-        query = query.filter(Post.tags.any(Tag.id == tagid))
-    
-    page = request.args.get('page', 1, type=int)
-        
-    pagination = query.paginate(page=page, per_page=10, error_out=False)
+    tagids = sorted(set(request.args.getlist("tag", type=int)))
+    match = "all" if request.args.get("match") == "all" else "any"
+    page = request.args.get("page", None, type=int)
+    after = request.args.get("after")
+    before = request.args.get("before")
     
     last_read_str = request.cookies.get('last_read')
     last_read = None
@@ -27,28 +34,164 @@ def home():
             last_read = datetime.fromisoformat(last_read_str)
         except ValueError:
             last_read = None
+    
+    version, updated_at = board_state()
+    etag = make_etag("board", version, tagids, match, page, after, before, last_read_str, current_user.get_id())
+    if not_modified(etag, updated_at):
+        resp = not_modified_response(etag, updated_at)
+    else:
+        board = get_board(tag_ids=tagids, match_all=match == "all", page=page, after=after, before=before, version=version)
+        facets = get_tag_facets(version)
+        
+        newest_post = max((p["created_at"] for p in board["posts"]), default=None)
+        
+        resp = make_response(render_template("board.html", board=board, facets=facets, tagids=tagids, match=match, last_read=last_read))
+        resp.set_etag(etag)
+        if updated_at:
+            resp.last_modified = updated_at
+        
+        if newest_post and (not last_read or newest_post > last_read):
+            resp.set_cookie('last_read', newest_post.isoformat(), max_age=60*60*24*365, samesite='Lax', path='/')
+    
+    resp.cache_control.no_cache = True
+    resp.vary.add("Cookie")
+            
+    return resp
 
-    newest_post = max((p.created_at for p in pagination.items), default=None)
+@bp.route("/search")
+def search():
+    q = request.args.get("q", "").strip()
+    tagids = sorted(set(request.args.getlist("tag", type=int)))
+    match = "all" if request.args.get("match") == "all" else "any"
     
-    resp = make_response(render_template("board.html", pagination=pagination, tagid=tagid, last_read=last_read))
+    results = search_posts(q, tag_ids=tagids, match_all=match == "all", after=request.args.get("after")) if q else CursorPage([])
+    board = {
+        "posts": [{"created_at": post.created_at, "html": render_template("board-post.html", post=post)} for post in results.items],
+        "prev_cursor": None,
+        "next_cursor": results.next_cursor,
+    }
     
-    if newest_post:
-        resp.set_cookie('last_read', newest_post.isoformat(), max_age=60*60*24*365, samesite='Lax', path='/')
+    return render_template("board.html", board=board, tagids=tagids, match=match, query=q)
 
-            
+def feed_response(fmt):
+    tagid = request.args.get("tag", None, type=int)
+    
+    version, updated_at = board_state()
+    etag = make_etag("feed", fmt, version, tagid)
+    if not_modified(etag, updated_at):
+        resp = not_modified_response(etag, updated_at)
+    else:
+        tag = db.get_or_404(Tag, tagid) if tagid else None
+        resp = make_response(get_feed(fmt, version, tag))
+        resp.mimetype = FEED_MIMETYPES[fmt]
+        resp.set_etag(etag)
+        if updated_at:
+            resp.last_modified = updated_at
+    
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 60
+    return resp
+
+@bp.route("/feed.atom")
+def feed_atom():
+    return feed_response("atom")
+
+@bp.route("/feed.json")
+def feed_json():
+    return feed_response("json")
+
+@bp.route("/events")
+def events():
+    broker = current_app.extensions["post_event_broker"]
+    keepalive = current_app.config["SSE_KEEPALIVE"]
+    
+    last_id = request.headers.get("Last-Event-ID", None, type=int)
+    if last_id is None:
+        last_id = broker.latest_id()
+    
+    def stream(last_id):
+        yield "retry: 5000\n\n"
+        while True:
+            events = broker.events_after(last_id, keepalive)
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                yield f"id: {event['id']}\nevent: {event['kind']}\ndata: {json.dumps(event)}\n\n"
+                last_id = event["id"]
+    
+    resp = Response(stream(last_id), mimetype="text/event-stream")
+    resp.cache_control.no_cache = True
+    resp.headers["X-Accel-Buffering"] = "no"
     return resp
 
 @bp.route("/favicon.ico")
 def favicon():
     return redirect(url_for("static", filename="icons/favicon.ico"))
 
+def offload_response(name, mimetype):
+    storage = get_storage()
+    mode = current_app.config["FILE_OFFLOAD_MODE"]
+    resp = Response(mimetype=mimetype or "application/octet-stream")
+    if mode == "x-accel-redirect":
+        # nginx: location <FILE_OFFLOAD_PREFIX> { internal; alias <upload folder>/; }
+        resp.headers["X-Accel-Redirect"] = current_app.config["FILE_OFFLOAD_PREFIX"].rstrip("/") + "/" + quote(storage.relative_path(name))
+    elif mode == "x-sendfile":
+        resp.headers["X-Sendfile"] = storage.local_path(name)
+    else:
+        raise ValueError(f"Unknown FILE_OFFLOAD_MODE: {mode}")
+    return resp
+
+def stored_file_response(name, mimetype, etag, last_modified):
+    if not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    
+    storage = get_storage()
+    url = storage.url(name, mimetype)
+    if url:
+        return redirect(url)
+    
+    if current_app.config["FILE_OFFLOAD_MODE"] != "direct":
+        resp = offload_response(name, mimetype)
+        resp.set_etag(etag)
+        resp.last_modified = last_modified
+        return resp
+    return send_upload(storage.local_path(name), mimetype, etag, last_modified)
+
+def can_view_file(file):
+    return file.status == FileStatus.visible or (current_user.is_authenticated and (current_user.role == UserRole.superadmin or current_user.role == UserRole.admin))
+
+def set_file_cache_control(resp, file):
+    if file.status == FileStatus.visible:
+        resp.cache_control.no_cache = None
+        resp.cache_control.public = True
+        resp.cache_control.max_age = 300
+    else:
+        resp.cache_control.private = True
+        resp.cache_control.no_cache = True
+        resp.vary.add("Cookie")
+    return resp
+
 @bp.route("/uploads/<filename>")
 def userfile(filename):
-    path = os.path.join("uploads", filename)
-    
-    file = File.query.filter_by(filename=filename).first_or_404()
+    file = get_file_record(filename)
+    if file is None:
+        abort(404)
     
-    if file.status != FileStatus.visible and not (current_user.is_authenticated and (current_user.role == UserRole.superadmin or current_user.role == UserRole.admin)):
-        return render_template("file-blocked.html", name=file.name)
+    # cached records are never trusted for access: the status check runs on every hit
+    if not can_view_file(file):
+        return render_template("file-blocked.html", name=file.name), 403
 
-    return send_file(path, mimetype=file.mimetype)
\ No newline at end of file
+    etag = make_etag("file", file.id, file.size, file.created_at.isoformat(), file.status.name)
+    resp = stored_file_response(file.key, file.mimetype, etag, file.created_at)
+    return set_file_cache_control(resp, file)
+
+@bp.route("/uploads/<filename>/preview")
+def userfile_preview(filename):
+    file = get_file_record(filename)
+    if file is None or file.preview_status != FilePreviewStatus.ready or not can_view_file(file):
+        abort(404)
+    
+    etag = make_etag("preview", file.id, file.preview, file.status.name)
+    resp = stored_file_response(file.preview, "image/webp", etag, file.created_at)
+    return set_file_cache_control(resp, file)
\ No newline at end of file
@@ -0,0 +1,120 @@
+from flask import current_app
+from sqlalchemy import event, cast, func, literal, literal_column, or_, and_, table, column
+from sqlalchemy.dialects.postgresql import REGCONFIG
+
+from app.extensions import db
+from app.models import Post, PostStatus, User
+from app.main.pagination import CursorPage, encode_token, decode_token
+from app.main.feed import with_feed_relations, filter_tags
+
+TS_CONFIG = "itos_search"
+
+def postgres_search_ddl(dictionaries):
+    return [
+        "CREATE EXTENSION IF NOT EXISTS unaccent",
+        f"""DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = '{TS_CONFIG}') THEN
+                CREATE TEXT SEARCH CONFIGURATION {TS_CONFIG} (COPY = simple);
+                ALTER TEXT SEARCH CONFIGURATION {TS_CONFIG} ALTER MAPPING FOR hword, hword_part, word WITH {", ".join(dictionaries)};
+            END IF;
+        END $$""",
+        f"""ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('{TS_CONFIG}', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('{TS_CONFIG}', coalesce(content, '')), 'B')
+        ) STORED""",
+        "CREATE INDEX IF NOT EXISTS ix_posts_search_vector ON posts USING GIN (search_vector)",
+    ]
+
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(title, content, content='posts', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_ai AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_ad AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_au AFTER UPDATE OF title, content ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    "INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')",
+]
+
+def install_search(connection, dictionaries=("unaccent", "simple")):
+    if connection.dialect.name == "postgresql":
+        statements = postgres_search_ddl(dictionaries)
+    elif connection.dialect.name == "sqlite":
+        statements = SQLITE_SEARCH_DDL
+    else:
+        return False
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+    return True
+
+@event.listens_for(Post.__table__, "after_create")
+def install_search_on_create(target, connection, **kw):
+    install_search(connection, current_app.config["SEARCH_DICTIONARIES"])
+
+posts_fts = table("posts_fts", column("rowid"), column("posts_fts"))
+
+def fts5_query(q):
+    words = [word.replace('"', '""') for word in q.split()]
+    return " ".join(f'"{word}"*' for word in words if word)
+
+def match_and_rank(q):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        tsquery = func.websearch_to_tsquery(cast(literal(TS_CONFIG), REGCONFIG), q)
+        search_vector = literal_column("posts.search_vector")
+        return search_vector.op("@@")(tsquery), func.ts_rank_cd(search_vector, tsquery), None
+    if dialect == "sqlite":
+        # bm25() is lower-is-better, negate it so both backends rank descending
+        rank = -func.bm25(literal_column("posts_fts"), 10.0, 1.0)
+        return posts_fts.c.posts_fts.op("MATCH")(fts5_query(q)), rank, posts_fts
+    return or_(Post.title.ilike(f"%{q}%"), Post.content.ilike(f"%{q}%")), literal(0.0), None
+
+def search_criterion(q):
+    if not q or not q.strip():
+        return None
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "sqlite":
+        return Post.id.in_(db.select(posts_fts.c.rowid).where(posts_fts.c.posts_fts.op("MATCH")(fts5_query(q))))
+    match, _, _ = match_and_rank(q)
+    return match
+
+def decode_search_cursor(token):
+    values = decode_token(token)
+    if not values or len(values) != 2:
+        return None
+    last_rank, last_id = values
+    # bool is an int subclass, so reject it explicitly; anything else malformed is ignored like a bad board cursor
+    if isinstance(last_rank, bool) or not isinstance(last_rank, (int, float)) or isinstance(last_id, bool) or not isinstance(last_id, int):
+        return None
+    return float(last_rank), last_id
+
+def search_posts(q, tag_ids=None, match_all=False, after=None, per_page=10):
+    match, rank, join = match_and_rank(q)
+    rank = rank.label("rank")
+    query = with_feed_relations(Post.query.filter(Post.status == PostStatus.visible))
+    if join is not None:
+        query = query.join(join, join.c.rowid == Post.id)
+    query = query.filter(match).add_columns(rank)
+    query = filter_tags(query, tag_ids, match_all)
+
+    cursor = decode_search_cursor(after)
+    if cursor:
+        last_rank, last_id = cursor
+        query = query.filter(or_(rank < last_rank, and_(rank == last_rank, Post.id < last_id)))
+
+    rows = query.order_by(rank.desc(), Post.id.desc()).limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    next_cursor = encode_token([rows[-1].rank, rows[-1][0].id]) if more else None
+    return CursorPage([row[0] for row in rows], next_cursor=next_cursor)
+
+def admin_search_criterion(q):
+    criterion = search_criterion(q)
+    if criterion is None:
+        return None
+    names = [Post.author.has(or_(User.first_name.ilike(f"%{term}%"), User.last_name.ilike(f"%{term}%"))) for term in q.split()]
+    return or_(criterion, and_(*names))
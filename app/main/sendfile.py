@@ -0,0 +1,93 @@
+import os
+import uuid
+from flask import request, Response
+
+BUFFER_SIZE = 64 * 1024
+
+def read_range(f, start, length):
+    f.seek(start)
+    while length > 0:
+        chunk = f.read(min(BUFFER_SIZE, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
+
+def file_body(f, start, length):
+    f.seek(start)
+    # WSGI servers must not send more than Content-Length, and gunicorn's file_wrapper
+    # starts sendfile() at the current offset, so single ranges stay zero-copy as well
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is not None:
+        return file_wrapper(f, BUFFER_SIZE)
+    return closing_iter(f, read_range(f, start, length))
+
+def closing_iter(f, chunks):
+    try:
+        yield from chunks
+    finally:
+        f.close()
+
+def if_range_matches(etag, last_modified):
+    if_range = request.if_range
+    if if_range.etag is None and if_range.date is None:
+        return True
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    return last_modified is not None and if_range.date.replace(tzinfo=None) == last_modified.replace(microsecond=0)
+
+def satisfiable_ranges(ranges, size):
+    result = []
+    for start, stop in ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            result.append((start, stop))
+    return result
+
+def send_upload(path, mimetype, etag, last_modified):
+    mimetype = mimetype or "application/octet-stream"
+    f = open(path, "rb")
+    size = os.fstat(f.fileno()).st_size
+    
+    ranges = None
+    if request.range is not None and request.range.units == "bytes" and if_range_matches(etag, last_modified):
+        ranges = satisfiable_ranges(request.range.ranges, size)
+        if not ranges:
+            f.close()
+            resp = Response(status=416)
+            resp.headers["Content-Range"] = f"bytes */{size}"
+            return resp
+    
+    if not ranges:
+        resp = Response(file_body(f, 0, size), mimetype=mimetype, direct_passthrough=True)
+        resp.content_length = size
+    elif len(ranges) == 1:
+        start, stop = ranges[0]
+        resp = Response(file_body(f, start, stop - start), status=206, mimetype=mimetype, direct_passthrough=True)
+        resp.content_length = stop - start
+        resp.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    else:
+        boundary = uuid.uuid4().hex
+        parts = [
+            (f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\nContent-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n".encode(), start, stop)
+            for start, stop in ranges
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode()
+        
+        def multipart():
+            for header, start, stop in parts:
+                yield header
+                yield from read_range(f, start, stop - start)
+            yield closing
+        
+        resp = Response(closing_iter(f, multipart()), status=206, mimetype=f"multipart/byteranges; boundary={boundary}", direct_passthrough=True)
+        resp.content_length = sum(len(header) + stop - start for header, start, stop in parts) + len(closing)
+    
+    resp.accept_ranges = "bytes"
+    resp.set_etag(etag)
+    if last_modified:
+        resp.last_modified = last_modified
+    return resp
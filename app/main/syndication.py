@@ -0,0 +1,77 @@
+import json
+from flask import render_template, url_for, current_app
+
+from app.models import Post
+from app.cache import get_cache
+from app.main.feed import board_query
+
+FEED_MIMETYPES = {
+    "atom": "application/atom+xml",
+    "json": "application/feed+json",
+}
+
+def rfc3339(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def entry_key(fmt, post):
+    updated = post.updated_at or post.created_at
+    tags = ",".join(f"{tag.id}:{tag.name}" for tag in post.tags)
+    return f"feed-entry:{fmt}:{post.id}:{updated.isoformat()}:{post.author.first_name} {post.author.last_name}:{tags}"
+
+def render_entry(fmt, post):
+    if fmt == "atom":
+        return render_template("feed-entry.xml", post=post, rfc3339=rfc3339)
+    return {
+        "id": str(post.id),
+        "url": url_for("main.home", _external=True) + f"#post-{post.id}",
+        "title": post.title,
+        "content_html": post.rendered_html or post.content,
+        "date_published": rfc3339(post.created_at),
+        "date_modified": rfc3339(post.updated_at or post.created_at),
+        "authors": [{"name": f"{post.author.first_name} {post.author.last_name}"}],
+        "tags": [tag.name for tag in post.tags],
+    }
+
+# Entries are cached on their own, keyed by what they show, so a new post only
+# serializes itself; the rest of the feed is reassembled from cached entries.
+def feed_entries(fmt, posts):
+    cache = get_cache()
+    entries = []
+    for post in posts:
+        key = entry_key(fmt, post)
+        entry = cache.get(key)
+        if entry is None:
+            entry = render_entry(fmt, post)
+            cache.set(key, entry)
+        entries.append(entry)
+    return entries
+
+def build_feed(fmt, tag=None):
+    query = board_query([tag.id] if tag else None).order_by(Post.created_at.desc(), Post.id.desc())
+    posts = query.limit(current_app.config["FEED_SIZE"]).all()
+    entries = feed_entries(fmt, posts)
+    
+    title = "ITOS XIV LO" + (f" - {tag.name}" if tag else "")
+    home_url = url_for("main.home", tag=tag.id if tag else None, _external=True)
+    feed_url = url_for(f"main.feed_{fmt}", tag=tag.id if tag else None, _external=True)
+    updated = max((post.updated_at or post.created_at for post in posts), default=None)
+    
+    if fmt == "atom":
+        return render_template("feed.xml", title=title, home_url=home_url, feed_url=feed_url, updated=updated, entries=entries, rfc3339=rfc3339)
+    return json.dumps({
+        "version": "https://jsonfeed.org/version/1.1",
+        "title": title,
+        "home_page_url": home_url,
+        "feed_url": feed_url,
+        "language": "pl",
+        "items": entries,
+    }, ensure_ascii=False)
+
+def get_feed(fmt, version, tag=None):
+    key = f"feed:{fmt}:{version}:{tag.id if tag else ''}"
+    cache = get_cache()
+    feed = cache.get(key)
+    if feed is None:
+        feed = build_feed(fmt, tag)
+        cache.set(key, feed)
+    return feed
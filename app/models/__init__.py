@@ -2,15 +2,207 @@ from .person import Person
 from .user import User, UserRole
 from .post import Post, PostStatus
 from .tag import Tag
-from .file import File, FileStatus
+from .file import File, FileStatus, FilePreviewStatus, PREVIEW_MIMETYPES, QuotaExceeded
+from .post_tags import post_tags
+from .post_files import post_files
+from .board_state import BoardState
+from .post_event import PostEvent, PostEventKind
+from .upload_session import UploadSession
+from .blob import Blob
+from .storage_tombstone import StorageTombstone
+from .outbox import OutboxMessage, OutboxStatus
+from .digest_tags import digest_tags
+from .digest_subscription import DigestSubscription, DigestFrequency
 
-from sqlalchemy import event
-import os
-from flask import current_app
+from sqlalchemy import event, update, insert, cast, BigInteger
+from sqlalchemy.orm import Session, object_session, attributes
+from datetime import datetime
+from flask import current_app, has_app_context
 
+@event.listens_for(File, "before_insert")
+def set_preview_status(mapper, connection, target):
+    if target.preview_status is None and target.mimetype in PREVIEW_MIMETYPES:
+        target.preview_status = FilePreviewStatus.pending
+
+def add_bytes_used(connection, user_id, amount):
+    table = User.__table__
+    connection.execute(update(table).where(table.c.id == user_id).values(bytes_used=table.c.bytes_used + amount, version=table.c.version + 1))
+
+@event.listens_for(File, "after_insert")
+def reserve_quota(mapper, connection, target):
+    # the quota check and the counter update are one statement, so concurrent uploads cannot both slip under the limit
+    table = User.__table__
+    charge = target.charge
+    query = update(table).where(table.c.id == target.user_id).values(bytes_used=table.c.bytes_used + charge, version=table.c.version + 1)
+    if charge:
+        query = query.where(table.c.bytes_used + charge <= cast(table.c.quota, BigInteger) * 1024 * 1024)
+    if connection.execute(query).rowcount == 0:
+        raise QuotaExceeded()
+
+@event.listens_for(File, "after_update")
+def move_quota(mapper, connection, target):
+    history = {key: attributes.get_history(target, key) for key in ("user_id", "size", "charged_size")}
+    if not any(h.has_changes() for h in history.values()):
+        return
+    
+    user_id, size, charged = [h.deleted[0] if h.deleted else getattr(target, key) for key, h in history.items()]
+    old_charge = (size if charged is None else charged) or 0
+    add_bytes_used(connection, user_id, -old_charge)
+    add_bytes_used(connection, target.user_id, target.charge)
+
+@event.listens_for(File, "after_delete")
+def release_quota(mapper, connection, target):
+    add_bytes_used(connection, target.user_id, -target.charge)
+
+@event.listens_for(File, "after_delete")
+def queue_file_deletion(mapper, connection, target):
+    from app.storage import release_blob
+    
+    if target.blob_sha256:
+        if not release_blob(connection, target.blob_sha256):
+            return
+        names = [target.blob_sha256]
+    else:
+        names = [target.filename]
+    if target.preview:
+        names.append(target.preview)
+    
+    # the files are removed by the storage sweeper once this transaction commits
+    now = datetime.utcnow()
+    connection.execute(insert(StorageTombstone.__table__), [{"name": name, "attempts": 0, "created_at": now} for name in names])
+    object_session(target).info["storage_tombstones"] = True
+
+@event.listens_for(File, "after_update")
+@event.listens_for(File, "after_delete")
+def mark_file_record_stale(mapper, connection, target):
+    session = object_session(target)
+    session.info.setdefault("stale_file_records", set()).update(
+        value for value in attributes.get_history(target, "filename").sum() if value
+    )
+
+@event.listens_for(Session, "after_commit")
+def invalidate_file_records(session):
+    filenames = session.info.pop("stale_file_records", None)
+    if filenames and has_app_context():
+        cache = current_app.extensions["file_cache"]
+        for filename in filenames:
+            cache.delete(filename)
+
+@event.listens_for(Session, "after_rollback")
+def keep_file_records(session):
+    session.info.pop("stale_file_records", None)
+
+@event.listens_for(User, "before_update")
+def bump_user_version(mapper, connection, target):
+    if object_session(target).is_modified(target, include_collections=False):
+        target.version = User.version + 1
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def mark_user_stale(mapper, connection, target):
+    object_session(target).info.setdefault("stale_users", set()).add(target.id)
+
+@event.listens_for(File, "after_insert")
+@event.listens_for(File, "after_update")
 @event.listens_for(File, "after_delete")
-def delete_file_on_disk(mapper, connection, target):
-    file_path = os.path.join(current_app.root_path, "uploads", target.filename)  # adjust your uploads folder
+def mark_file_owner_stale(mapper, connection, target):
+    object_session(target).info.setdefault("stale_users", set()).update(
+        value for value in attributes.get_history(target, "user_id").sum() if value
+    )
+
+@event.listens_for(Session, "after_commit")
+def invalidate_users(session):
+    user_ids = session.info.pop("stale_users", None)
+    if user_ids and has_app_context():
+        cache = current_app.extensions["user_cache"]
+        for user_id in user_ids:
+            cache.delete(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def keep_users(session):
+    session.info.pop("stale_users", None)
+
+@event.listens_for(Session, "after_commit")
+def wake_storage_sweeper(session):
+    if session.info.pop("storage_tombstones", False) and has_app_context():
+        current_app.extensions["storage_sweeper"].wake()
+
+@event.listens_for(Session, "after_rollback")
+def forget_storage_tombstones(session):
+    session.info.pop("storage_tombstones", None)
+
+@event.listens_for(Post, "before_insert")
+@event.listens_for(Post, "before_update")
+def render_post_html(mapper, connection, target):
+    from app.render import render_post, renderer
     
-    if os.path.exists(file_path):
-        os.remove(file_path)
\ No newline at end of file
+    if target.rendered_html is None or target.renderer_version != renderer.version or attributes.get_history(target, "content").has_changes():
+        render_post(target)
+
+# Digests select on this rather than on post_events, which the SSE broker prunes after a day.
+@event.listens_for(Post, "before_insert")
+def stamp_new_post(mapper, connection, target):
+    if target.status in (None, PostStatus.visible):
+        target.published_at = datetime.utcnow()
+
+@event.listens_for(Post, "before_update")
+def stamp_published_post(mapper, connection, target):
+    status = attributes.get_history(target, "status")
+    if target.status == PostStatus.visible and PostStatus.visible not in (status.deleted or status.unchanged):
+        target.published_at = datetime.utcnow()
+
+# Changing post.tags / post.files (or tag.posts / file.posts) marks the owning objects dirty,
+# so rows added to or removed from post_tags and post_files also end up here as after_update.
+@event.listens_for(Post, "after_insert")
+@event.listens_for(Post, "after_update")
+@event.listens_for(Post, "after_delete")
+@event.listens_for(Tag, "after_insert")
+@event.listens_for(Tag, "after_update")
+@event.listens_for(Tag, "after_delete")
+@event.listens_for(File, "after_insert")
+@event.listens_for(File, "after_update")
+@event.listens_for(File, "after_delete")
+def bump_board_version(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        if session.info.get("board_version_bumped"):
+            return
+        session.info["board_version_bumped"] = True
+    
+    table = BoardState.__table__
+    now = datetime.utcnow()
+    result = connection.execute(update(table).where(table.c.id == 1).values(version=table.c.version + 1, updated_at=now))
+    if result.rowcount == 0:
+        connection.execute(insert(table).values(id=1, version=1, updated_at=now))
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def reset_board_version_flag(session):
+    session.info.pop("board_version_bumped", None)
+
+
+def record_post_event(connection, post_id, kind):
+    connection.execute(insert(PostEvent.__table__).values(post_id=post_id, kind=kind, created_at=datetime.utcnow()))
+
+@event.listens_for(Post, "after_insert")
+def post_inserted(mapper, connection, target):
+    if target.status == PostStatus.visible:
+        record_post_event(connection, target.id, PostEventKind.published)
+
+@event.listens_for(Post, "after_update")
+def post_updated(mapper, connection, target):
+    status = attributes.get_history(target, "status")
+    was_visible = PostStatus.visible in (status.deleted or status.unchanged)
+    is_visible = target.status == PostStatus.visible
+    
+    if is_visible and not was_visible:
+        record_post_event(connection, target.id, PostEventKind.published)
+    elif was_visible and not is_visible:
+        record_post_event(connection, target.id, PostEventKind.hidden)
+    elif is_visible and any(attributes.get_history(target, key).has_changes() for key in ("title", "content", "tags", "files")):
+        record_post_event(connection, target.id, PostEventKind.updated)
+
+@event.listens_for(Post, "after_delete")
+def post_deleted(mapper, connection, target):
+    if target.status == PostStatus.visible:
+        record_post_event(connection, target.id, PostEventKind.hidden)
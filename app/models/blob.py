@@ -0,0 +1,17 @@
+from app.extensions import db
+from datetime import datetime
+
+class Blob(db.Model):
+    __tablename__ = "blobs"
+    
+    sha256 = db.Column(db.String(64), primary_key=True)
+    
+    size = db.Column(db.Integer, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    files = db.relationship("File", back_populates="blob")
+
+    def __repr__(self):
+        return f"{self.sha256[:12]} ({self.refcount})"
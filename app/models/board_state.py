@@ -0,0 +1,16 @@
+from app.extensions import db
+from datetime import datetime
+from sqlalchemy import event, DDL
+
+class BoardState(db.Model):
+    __tablename__ = "board_state"
+    
+    id = db.Column(db.Integer, primary_key=True)
+    
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"Board v{self.version}"
+
+event.listen(BoardState.__table__, "after_create", DDL("INSERT INTO board_state (id, version, updated_at) VALUES (1, 0, CURRENT_TIMESTAMP)"))
@@ -0,0 +1,28 @@
+from app.extensions import db
+from datetime import datetime
+from sqlalchemy import Enum
+from enum import Enum as PyEnum
+from app.models.digest_tags import digest_tags
+
+class DigestFrequency(PyEnum):
+    daily = "codziennie"
+    weekly = "co tydzień"
+
+class DigestSubscription(db.Model):
+    __tablename__ = "digest_subscriptions"
+    
+    id = db.Column(db.Integer, primary_key=True)
+    
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, unique=True)
+    frequency = db.Column(Enum(DigestFrequency, name="digest_frequency", native_enum=True, validate_strings=True), nullable=False, default=DigestFrequency.weekly, index=True)
+    
+    # no tags means every visible post
+    tags = db.relationship("Tag", secondary=digest_tags, lazy="select")
+    
+    last_sent_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    user = db.relationship("User", back_populates="digest_subscription")
+
+    def __repr__(self):
+        return f"{self.user} ({self.frequency.value})"
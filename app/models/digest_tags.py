@@ -0,0 +1,7 @@
+from app.extensions import db
+
+digest_tags = db.Table(
+    "digest_tags",
+    db.Column("subscription_id", db.Integer, db.ForeignKey("digest_subscriptions.id", ondelete="CASCADE"), primary_key=True),
+    db.Column("tag_id", db.Integer, db.ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True),
+)
@@ -3,6 +3,7 @@ from flask_login import UserMixin
 from datetime import datetime
 import os
 from sqlalchemy import Enum
+from sqlalchemy.orm import column_property
 from enum import Enum as PyEnum
 from app.models.post_files import post_files
 
@@ -11,6 +12,16 @@ class FileStatus(PyEnum):
     hidden = "ukryty"
     pending = "oczekujący"
 
+class FilePreviewStatus(PyEnum):
+    pending = "oczekujący"
+    ready = "gotowy"
+    failed = "niedostępny"
+
+PREVIEW_MIMETYPES = {"image/png", "image/jpeg", "image/gif", "application/pdf"}
+
+class QuotaExceeded(Exception):
+    pass
+
 class File(db.Model):
     __tablename__ = "files"
     
@@ -19,18 +30,29 @@ class File(db.Model):
     name = db.Column(db.String(120), unique=True, nullable=False)
     filename = db.Column(db.String(200), unique=True, nullable=False)
     
-    size = db.Column(db.Integer)
+    # active_history keeps the old values around for the bytes_used bookkeeping in after_update
+    size = column_property(db.Column(db.Integer), active_history=True)
+    charged_size = column_property(db.Column(db.Integer, nullable=True), active_history=True)
     mimetype = db.Column(db.String(50)) 
+    
+    preview = db.Column(db.String(200), nullable=True, index=True)
+    preview_status = db.Column(Enum(FilePreviewStatus, name="file_preview_status", native_enum=True, validate_strings=True), nullable=True)
 
     status = db.Column(Enum(FileStatus, name="file_status", native_enum=True, validate_strings=True), nullable=False, default=FileStatus.visible, index=True)
 
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    user_id = column_property(db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True), active_history=True)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey("blobs.sha256"), nullable=True, index=True)
     
     author = db.relationship("User", back_populates="files")
+    blob = db.relationship("Blob", back_populates="files")
     posts = db.relationship("Post", secondary=post_files, back_populates="files", lazy="select")
 
+    @property
+    def charge(self):
+        return (self.size if self.charged_size is None else self.charged_size) or 0
+
     def __repr__(self):
         return f"{self.name} ({self.author})"
\ No newline at end of file
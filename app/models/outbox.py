@@ -0,0 +1,31 @@
+from app.extensions import db
+from datetime import datetime
+from sqlalchemy import Enum
+from enum import Enum as PyEnum
+
+class OutboxStatus(PyEnum):
+    pending = "oczekująca"
+    sent = "wysłana"
+    dead = "odrzucona"
+
+class OutboxMessage(db.Model):
+    __tablename__ = "outbox"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    subject = db.Column(db.String(255), nullable=False)
+    recipients = db.Column(db.JSON, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    html = db.Column(db.Text, nullable=True)
+
+    status = db.Column(Enum(OutboxStatus, name="outbox_status", native_enum=True, validate_strings=True), nullable=False, default=OutboxStatus.pending, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+
+    # also serves as the worker's lease: claimed messages are pushed into the future until they are sent
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"{self.subject} ({self.status.value})"
@@ -5,13 +5,16 @@ class Person(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     
-    login = db.Column(db.String(50), nullable=False)
+    login = db.Column(db.String(50), nullable=False, unique=True, index=True)
     
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
     
     ldap_group = db.Column(db.String(10), nullable=False)
     
+    # set by import-people when the login disappears from the school roster
+    left_at = db.Column(db.DateTime, nullable=True)
+    
     user = db.relationship("User", back_populates="person", uselist=False)
     
     def __repr__(self):
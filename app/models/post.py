@@ -1,6 +1,7 @@
 from app.extensions import db
 from datetime import datetime
 from sqlalchemy import Enum
+from sqlalchemy.orm import column_property
 from enum import Enum as PyEnum
 
 from app.models.post_tags import post_tags
@@ -13,15 +14,25 @@ class PostStatus(PyEnum):
 
 class Post(db.Model):
     __tablename__ = "posts"
+    __table_args__ = (
+        db.Index("ix_posts_status_created_at", "status", "created_at", "id"),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
     title = db.Column(db.String(120), unique=False, nullable=False)
     content = db.Column(db.Text, unique=False, nullable=False)
     
-    status = db.Column(Enum(PostStatus, name="post_status", native_enum=True, validate_strings=True), nullable=False, default=PostStatus.visible, index=True)
+    rendered_html = db.Column(db.Text, nullable=True)
+    renderer_version = db.Column(db.Integer, nullable=True)
+    
+    # active_history keeps the previous status around for the post_events listeners
+    status = column_property(db.Column(Enum(PostStatus, name="post_status", native_enum=True, validate_strings=True), nullable=False, default=PostStatus.visible, index=True), active_history=True)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
+    # when the post last became visible; approval of a pending post counts, not when it was written
+    published_at = db.Column(db.DateTime, nullable=True, index=True)
     
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
     
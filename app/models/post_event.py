@@ -0,0 +1,22 @@
+from app.extensions import db
+from datetime import datetime
+from sqlalchemy import Enum
+from enum import Enum as PyEnum
+
+class PostEventKind(PyEnum):
+    published = "published"
+    updated = "updated"
+    hidden = "hidden"
+
+class PostEvent(db.Model):
+    __tablename__ = "post_events"
+    
+    id = db.Column(db.Integer, primary_key=True)
+    
+    post_id = db.Column(db.Integer, nullable=False, index=True)
+    kind = db.Column(Enum(PostEventKind, name="post_event_kind", native_enum=True, validate_strings=True), nullable=False)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"{self.kind.value} #{self.post_id}"
@@ -4,4 +4,5 @@ post_tags = db.Table(
     "post_tags",
     db.Column("post_id", db.Integer, db.ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True),
     db.Column("tag_id", db.Integer, db.ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True),
+    db.Index("ix_post_tags_tag_id_post_id", "tag_id", "post_id"),
 )
\ No newline at end of file
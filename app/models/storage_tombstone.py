@@ -0,0 +1,15 @@
+from app.extensions import db
+from datetime import datetime
+
+class StorageTombstone(db.Model):
+    __tablename__ = "storage_tombstones"
+    
+    id = db.Column(db.Integer, primary_key=True)
+    
+    name = db.Column(db.String(200), nullable=False, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"{self.name} ({self.attempts})"
@@ -0,0 +1,26 @@
+from app.extensions import db
+from datetime import datetime
+
+class UploadSession(db.Model):
+    __tablename__ = "upload_sessions"
+    
+    id = db.Column(db.String(32), primary_key=True)
+    
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    
+    name = db.Column(db.String(120), nullable=False)
+    filename = db.Column(db.String(200), nullable=False)
+    mimetype = db.Column(db.String(50))
+    
+    size = db.Column(db.Integer, nullable=False)
+    offset = db.Column(db.Integer, nullable=False, default=0)
+    # set while a chunk request is writing at `offset`; offset itself only moves once the data is on disk
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
+    
+    user = db.relationship("User")
+
+    def __repr__(self):
+        return f"{self.name} ({self.offset}/{self.size})"
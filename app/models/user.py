@@ -1,7 +1,8 @@
 from app.extensions import db
 from flask_login import UserMixin
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy import func, select, Enum
+from sqlalchemy import Enum
+from sqlalchemy.orm import query_expression
 from enum import Enum as PyEnum
 from app.models.tag_assigners import tag_assigners
 
@@ -29,16 +30,12 @@ class User(UserMixin, db.Model):
     
     quota = db.Column(db.Integer, nullable=False, default = 64)
     
+    # kept in step with the files table by the File insert/update/delete listeners
+    bytes_used = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    
     @hybrid_property
     def space_used(self):
-        return sum(f.size for f in self.files)
-
-    @space_used.expression
-    def space_used(cls):
-        from app.models.file import File
-        return select(
-            func.coalesce(func.sum(File.size), 0)
-        ).where(File.user_id == cls.id).scalar_subquery()
+        return self.bytes_used
     
     reputation = db.Column(db.Integer, nullable=False, default=70)
     
@@ -53,5 +50,16 @@ class User(UserMixin, db.Model):
     
     assignable_tags = db.relationship("Tag", secondary=tag_assigners, back_populates="allowed_users")
     
+    digest_subscription = db.relationship("DigestSubscription", back_populates="user", uselist=False, cascade="all, delete-orphan")
+    
+    # bumped on every change to the row, so cached user snapshots can tell they are stale
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    
+    # only loaded by the admin user lists, which fill them from grouped subqueries
+    file_count = query_expression()
+    file_bytes = query_expression()
+    post_count = query_expression()
+    quota_used = query_expression()
+    
     def __repr__(self):
         return f"{self.first_name} {self.last_name} ({self.email})"
\ No newline at end of file
@@ -1,38 +1,39 @@
-from flask import render_template, url_for, request, flash, redirect, current_app
+from flask import render_template, url_for, request, flash, redirect, current_app, jsonify
 from flask_login import current_user, login_required
-from werkzeug.security import check_password_hash, generate_password_hash
+from app.passwords import hash_password, check_password
+from app.throttle import throttle_wait, throttled_response
 from werkzeug.utils import secure_filename
 from app.extensions import db
-from app.models import User, Post, File, FileStatus, PostStatus, Tag
+from app.models import User, Post, File, FileStatus, PostStatus, Tag, UploadSession, QuotaExceeded, DigestSubscription, DigestFrequency
+from sqlalchemy import func, update
+from datetime import datetime, timedelta
 from itsdangerous import URLSafeTimedSerializer
 from email.utils import parseaddr
 from app.mail import send_button_message
-import bleach
+from app.main.feed import user_posts
+from app.query_budget import query_budget
+from app.render import sanitize_html
+from app.storage import upload_folder, temp_upload_path, save_hashed, get_upload_hashes, charged_size, acquire_blob, put_blob, discard_blob
+from app.previews import schedule_preview
 import os
 import uuid
+import mimetypes
 
 from app.panel import bp
 
 def get_assignable_tags():
     return Tag.query.filter((Tag.is_restricted == False) | (Tag.allowed_users.any(id=current_user.id))).order_by(Tag.name).all()
 
+def get_user_files():
+    return File.query.filter_by(user_id=current_user.id).order_by(File.created_at.desc()).all()
+
 @bp.route("/")
 @login_required
 def panel_home():
     space_used = round(current_user.space_used / (1024*1024), 2)
     percents = round(space_used/current_user.quota, 2)
-    return render_template("index.html", space_used=space_used, percents=percents)
-
-def sanitize_html(text):
-    return bleach.clean(
-        text,
-        tags=["a"],
-        attributes={
-            "a": ["href"]
-        },
-        protocols=["http", "https"],
-        strip=True
-    )
+    post_counts = dict(db.session.query(Post.status, func.count(Post.id)).filter(Post.user_id == current_user.id).group_by(Post.status).all())
+    return render_template("index.html", space_used=space_used, percents=percents, visible_posts=post_counts.get(PostStatus.visible, 0), hidden_posts=post_counts.get(PostStatus.hidden, 0))
 
 @bp.route("/create", methods=["GET", "POST"])
 @login_required
@@ -42,7 +43,7 @@ def create():
         content = request.form.get("content")
         if not title or not content:
             flash("Nie wypełniono wszystkich wymaganych pól!", "error")
-            return render_template("create.html", assignable_tags=get_assignable_tags())
+            return render_template("create.html", assignable_tags=get_assignable_tags(), user_files=get_user_files())
         status = PostStatus.pending
         if current_user.reputation >= 60:
             status = PostStatus.visible
@@ -50,10 +51,10 @@ def create():
         assignable_tags = Tag.query.filter((Tag.is_restricted == False) | (Tag.allowed_users.any(id=current_user.id))).filter(Tag.id.in_(tags)).all()
         if(len(assignable_tags) > 5):
             flash("Możesz wybrać do 5 kategorii!", "error")
-            return render_template("create.html", assignable_tags=get_assignable_tags())
+            return render_template("create.html", assignable_tags=get_assignable_tags(), user_files=get_user_files())
         fileids = [int(fid) for fid in request.form.get("files", "").split(",") if fid.strip().isdigit()]
         files = File.query.filter(File.user_id == current_user.id, File.id.in_(fileids)).all()
-        post = Post(title=title, content=sanitize_html(content), author=current_user, status=status, tags=assignable_tags, files=files)
+        post = Post(title=title, content=sanitize_html(content), user_id=current_user.id, status=status, tags=assignable_tags, files=files)
         db.session.add(post)
         db.session.commit()
         if status == PostStatus.visible:
@@ -61,17 +62,18 @@ def create():
         else:
             flash("Twoje ogłoszenie zostało wysłane do weryfikacji!", "success")
         return redirect(url_for("panel.news"))
-    return render_template("create.html", assignable_tags=get_assignable_tags())
+    return render_template("create.html", assignable_tags=get_assignable_tags(), user_files=get_user_files())
 
 @bp.route("/files")
 @login_required
 def files():
-    return render_template("files.html")
+    return render_template("files.html", files=get_user_files())
 
 @bp.route("/posts")
 @login_required
+@query_budget(6)
 def news():
-    return render_template("news.html")
+    return render_template("news.html", posts=user_posts(current_user.id))
 
 def generate_token(value):
     serializer = URLSafeTimedSerializer(current_app.config["SECRET_KEY"])
@@ -88,6 +90,10 @@ def confirm_token(token, expiration=1800):
 def is_valid_email(value: str) -> bool:
     return "@" in parseaddr(value)[1]
 
+def profile_context():
+    subscription = DigestSubscription.query.filter_by(user_id=current_user.id).first()
+    return dict(subscription=subscription, digest_tags=Tag.query.order_by(Tag.name).all(), DigestFrequency=DigestFrequency)
+
 @bp.route("/profile", methods=["GET", "POST"])
 @login_required
 def profile():
@@ -99,18 +105,21 @@ def profile():
             confirm_new_password = request.form.get("confirm_new_password")
             if not password or not new_password or not confirm_new_password:
                 flash("Nie wypełniono wszystkich wymaganych pól!", "error")
-                return render_template("profile.html")
-            if not check_password_hash(current_user.password_hash, password):
+                return render_template("profile.html", **profile_context())
+            wait = throttle_wait("change-password", current_user.email)
+            if wait:
+                return throttled_response("profile.html", wait, **profile_context())
+            if not check_password(current_user.password_hash, password):
                 flash("Błędne aktualne hasło!", "error")
-                return render_template("profile.html")
+                return render_template("profile.html", **profile_context())
             if new_password != confirm_new_password:
                 flash("Hasła nie były identyczne!", "error")
-                return render_template("profile.html")
-            if check_password_hash(current_user.password_hash, new_password):
+                return render_template("profile.html", **profile_context())
+            if check_password(current_user.password_hash, new_password):
                 flash("Nowe hasło nie może być takie samo jak aktualne!", "error")
-                return render_template("profile.html")  
+                return render_template("profile.html", **profile_context())  
             user = User.query.get(current_user.id)            
-            user.password_hash = generate_password_hash(new_password)
+            user.password_hash = hash_password(new_password)
             user.force_password_change = False
             db.session.commit()
             flash("Hasło zostało zmienione!", "success")
@@ -119,23 +128,54 @@ def profile():
             if email and email != current_user.email and is_valid_email(email):
                 if User.query.filter_by(email=email).first():
                     flash("Konto o podanym adresie email już istnieje!", "error")
-                    return render_template("profile.html")
+                    return render_template("profile.html", **profile_context())
                 user = User.query.get(current_user.id)   
                 user.email = email
                 user.email_confirmed = False
+                send_button_message("Potwierdzenie adresu email w systemie ITOS", "Aby potwierdzić adres email w systemie ITOS, kliknij poniższy przycisk.", [user.email], "Potwierdź", url_for("auth.confirm_email", token=generate_token(user.email), _external=True))
                 db.session.commit()
-                send_button_message("Potwierdzenie adresu email w systemie ITOS", "Aby potwierdzić adres email w systemie ITOS, kliknij poniższy przycisk.", [current_user.email], "Potwierdź", url_for("auth.confirm_email", token=generate_token(current_user.email), _external=True))
                 flash("Adres email zmieniony pomyślnie! Na nowy adres wysłaliśmy maila z linkiem pozwalającym na jego weryfikację.")
+        elif mode == "digest":
+            frequency = request.form.get("frequency")
+            subscription = DigestSubscription.query.filter_by(user_id=current_user.id).first()
+            if not frequency:
+                if subscription:
+                    db.session.delete(subscription)
+                    db.session.commit()
+                flash("Powiadomienia email zostały wyłączone.", "success")
+            elif frequency in DigestFrequency.__members__:
+                tag_ids = [int(tid) for tid in request.form.getlist("digest_tags") if tid.strip().isdigit()]
+                if subscription is None:
+                    subscription = DigestSubscription(user_id=current_user.id)
+                    db.session.add(subscription)
+                subscription.frequency = DigestFrequency[frequency]
+                subscription.tags = Tag.query.filter(Tag.id.in_(tag_ids)).all()
+                db.session.commit()
+                flash("Ustawienia powiadomień zostały zapisane.", "success")
+            else:
+                flash("Nieprawidłowa częstotliwość powiadomień!", "error")
+                return render_template("profile.html", **profile_context())
         else:
             flash("Nie mogliśmy rozpoznać formularza, który wypełniłeś. Jeśli problem się powtórzy, skontaktuj się z administratorem.", "error")
-            return render_template("profile.html")
-    return render_template("profile.html")
+            return render_template("profile.html", **profile_context())
+    return render_template("profile.html", **profile_context())
 
 ALLOWED_EXTENSIONS = ["png", "jpg", "jpeg", "gif", "pdf", "txt"]
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def disallowed_file_message():
+    message = "Niedozwolony format pliku! (Akceptujemy "
+    for i in range(len(ALLOWED_EXTENSIONS) - 1):
+        message += ALLOWED_EXTENSIONS[i] + ", "
+    message += ALLOWED_EXTENSIONS[-1] + ")"
+    return message
+
+def space_left(user):
+    reserved = db.session.query(func.coalesce(func.sum(UploadSession.size), 0)).filter(UploadSession.user_id == user.id).scalar()
+    return user.quota * 1024 * 1024 - user.space_used - reserved
+
 @bp.route("/upload", methods=["GET", "POST"])
 @login_required
 def upload():
@@ -146,11 +186,7 @@ def upload():
             flash("Nie wypełniono wszystkich wymaganych pól!", "error")
             return render_template("upload.html")
         if not allowed_file(file.filename):
-            message = "Niedozwolony format pliku! (Akceptujemy "
-            for i in range(len(ALLOWED_EXTENSIONS) - 1):
-                message += ALLOWED_EXTENSIONS[i] + ", "
-            message += ALLOWED_EXTENSIONS[-1] + ")"
-            flash(message, "error")
+            flash(disallowed_file_message(), "error")
             return render_template("upload.html")
         
         if File.query.filter_by(user_id=current_user.id, name=name).first():
@@ -160,25 +196,34 @@ def upload():
         secured_filename = secure_filename(name + "." + file.filename.rsplit(".", 1)[1].lower())
         filename = f"{uuid.uuid4().hex}_{secured_filename}"
         
-        file.seek(0, os.SEEK_END)
-        size = file.tell()
-        file.seek(0) 
-        
-        if size > current_user.quota * 1024 * 1024- current_user.space_used:
-            flash("Masz na koncie zbyt mało miejsca, aby wgrać ten plik!", "error")
-            return render_template("upload.html")
+        temp_path = temp_upload_path()
+        digest, size = save_hashed(file.stream, temp_path)
+        charge = charged_size(digest, size)
         
         status = FileStatus.pending
         if current_user.reputation >= 60:
             status = FileStatus.visible
         
-        new_file = File(name=name, filename=filename, user_id=current_user.id, mimetype=file.mimetype, size=size, status=status)
+        acquire_blob(digest, size)
+        new_file = File(name=name, filename=filename, user_id=current_user.id, mimetype=file.mimetype, size=size, charged_size=charge, blob_sha256=digest, status=status)
         db.session.add(new_file)
+        try:
+            db.session.flush()
+        except QuotaExceeded:
+            db.session.rollback()
+            os.remove(temp_path)
+            flash("Masz na koncie zbyt mało miejsca, aby wgrać ten plik!", "error")
+            return render_template("upload.html")
         
-        db.session.commit()
-        
-        file_path = os.path.join(current_app.root_path, "uploads", filename)
-        file.save(file_path)
+        put_blob(temp_path, digest)
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            discard_blob(digest)
+            db.session.commit()
+            raise
+        schedule_preview(new_file)
         
         if status == FileStatus.visible:
             flash("Twój plik został zapisany.", "success")
@@ -187,6 +232,184 @@ def upload():
         return redirect(url_for("panel.files"))
     return render_template("upload.html")
 
+def upload_part_path(upload):
+    return os.path.join(upload_folder(), f".{upload.id}.part")
+
+def prune_upload_sessions():
+    expired = UploadSession.query.filter(UploadSession.updated_at < datetime.utcnow() - timedelta(seconds=current_app.config["UPLOAD_SESSION_TTL"])).all()
+    for upload in expired:
+        if os.path.exists(upload_part_path(upload)):
+            os.remove(upload_part_path(upload))
+        get_upload_hashes().discard(upload.id)
+        db.session.delete(upload)
+    db.session.commit()
+
+def get_upload_session(upload_id):
+    return UploadSession.query.filter_by(id=upload_id, user_id=current_user.id).first()
+
+def upload_session_json(upload):
+    return jsonify(id=upload.id, offset=upload.offset, size=upload.size, chunk_size=current_app.config["UPLOAD_CHUNK_SIZE"])
+
+@bp.route("/upload/init", methods=["POST"])
+@login_required
+def upload_init():
+    prune_upload_sessions()
+    
+    name = request.form.get("name")
+    original_filename = request.form.get("filename")
+    size = request.form.get("size", None, type=int)
+    if not name or not original_filename or size is None or size < 0:
+        return jsonify(error="Nie wypełniono wszystkich wymaganych pól!"), 400
+    if not allowed_file(original_filename):
+        return jsonify(error=disallowed_file_message()), 400
+    
+    upload = UploadSession.query.filter_by(user_id=current_user.id, name=name).first()
+    if upload and upload.size == size:
+        return upload_session_json(upload)
+    if upload or File.query.filter_by(user_id=current_user.id, name=name).first():
+        return jsonify(error="Masz już plik o tej nazwie!"), 409
+    
+    if size > space_left(current_user):
+        return jsonify(error="Masz na koncie zbyt mało miejsca, aby wgrać ten plik!"), 413
+    
+    secured_filename = secure_filename(name + "." + original_filename.rsplit(".", 1)[1].lower())
+    mimetype = request.form.get("mimetype") or mimetypes.guess_type(original_filename)[0]
+    upload = UploadSession(id=uuid.uuid4().hex, user_id=current_user.id, name=name, filename=f"{uuid.uuid4().hex}_{secured_filename}", mimetype=mimetype[:50] if mimetype else None, size=size)
+    
+    open(upload_part_path(upload), "wb").close()
+    db.session.add(upload)
+    db.session.commit()
+    return upload_session_json(upload), 201
+
+@bp.route("/upload/<upload_id>", methods=["GET"])
+@login_required
+def upload_status(upload_id):
+    upload = get_upload_session(upload_id)
+    if not upload:
+        return jsonify(error="Nie znaleziono przesyłanego pliku!"), 404
+    return upload_session_json(upload)
+
+@bp.route("/upload/<upload_id>", methods=["PUT"])
+@login_required
+def upload_chunk(upload_id):
+    upload = get_upload_session(upload_id)
+    if not upload:
+        return jsonify(error="Nie znaleziono przesyłanego pliku!"), 404
+    
+    offset = request.args.get("offset", None, type=int)
+    if offset != upload.offset:
+        return jsonify(error="Nieprawidłowy fragment pliku.", offset=upload.offset), 409
+    length = request.content_length
+    if length is None:
+        return jsonify(error="Brak nagłówka Content-Length.", offset=upload.offset), 411
+    if length > upload.size - offset:
+        return jsonify(error="Fragment przekracza zadeklarowany rozmiar pliku.", offset=upload.offset), 413
+    
+    # claim the session before touching the .part file: only the request that still sees the old offset
+    # and no live claim may write, so a retried or duplicated chunk cannot write over one in progress
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=current_app.config["UPLOAD_CLAIM_TIMEOUT"])
+    result = db.session.execute(
+        update(UploadSession)
+        .where(UploadSession.id == upload.id, UploadSession.offset == offset, (UploadSession.claimed_at == None) | (UploadSession.claimed_at < stale))
+        .values(claimed_at=now, updated_at=now)
+    )
+    db.session.commit()
+    if result.rowcount == 0:
+        db.session.refresh(upload)
+        return jsonify(error="Nieprawidłowy fragment pliku.", offset=upload.offset), 409
+    
+    written = 0
+    try:
+        digest = get_upload_hashes().take(upload.id, offset, upload_part_path(upload))
+        with open(upload_part_path(upload), "r+b") as part:
+            part.seek(offset)
+            part.truncate()
+            while True:
+                chunk = request.stream.read(64 * 1024)
+                if not chunk:
+                    break
+                part.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+            part.flush()
+            os.fsync(part.fileno())
+    finally:
+        # a chunk that was cut short only releases the claim, so the client can send it again
+        db.session.rollback()
+        db.session.execute(
+            update(UploadSession)
+            .where(UploadSession.id == upload.id, UploadSession.offset == offset, UploadSession.claimed_at == now)
+            .values(offset=offset + written if written == length else offset, claimed_at=None, updated_at=datetime.utcnow())
+        )
+        db.session.commit()
+    
+    db.session.refresh(upload)
+    if written != length:
+        return jsonify(error="Przesyłanie fragmentu zostało przerwane.", offset=upload.offset), 400
+    get_upload_hashes().set(upload.id, upload.offset, digest)
+    return upload_session_json(upload)
+
+@bp.route("/upload/<upload_id>/finalize", methods=["POST"])
+@login_required
+def upload_finalize(upload_id):
+    upload = get_upload_session(upload_id)
+    if not upload:
+        return jsonify(error="Nie znaleziono przesyłanego pliku!"), 404
+    if upload.offset != upload.size:
+        return jsonify(error="Plik nie został jeszcze w całości przesłany.", offset=upload.offset), 409
+    
+    status = FileStatus.pending
+    if current_user.reputation >= 60:
+        status = FileStatus.visible
+    
+    part_path = upload_part_path(upload)
+    hashed = get_upload_hashes().take(upload.id, upload.size, part_path)
+    digest = hashed.hexdigest()
+    charge = charged_size(digest, upload.size)
+    
+    acquire_blob(digest, upload.size)
+    new_file = File(name=upload.name, filename=upload.filename, user_id=current_user.id, mimetype=upload.mimetype, size=upload.size, charged_size=charge, blob_sha256=digest, status=status)
+    db.session.add(new_file)
+    db.session.delete(upload)
+    try:
+        db.session.flush()
+    except QuotaExceeded:
+        db.session.rollback()
+        get_upload_hashes().set(upload.id, upload.size, hashed)
+        return jsonify(error="Masz na koncie zbyt mało miejsca, aby wgrać ten plik!"), 413
+    
+    put_blob(part_path, digest)
+    try:
+        db.session.commit()
+    except Exception:
+        # the .part file is gone into storage, so this session cannot be finalized again
+        db.session.rollback()
+        discard_blob(digest)
+        db.session.delete(upload)
+        db.session.commit()
+        raise
+    schedule_preview(new_file)
+    
+    if status == FileStatus.visible:
+        flash("Twój plik został zapisany.", "success")
+    else:
+        flash("Twój plik został wysłany do weryfikacji.", "success")
+    return jsonify(redirect=url_for("panel.files"))
+
+@bp.route("/upload/<upload_id>", methods=["DELETE"])
+@login_required
+def upload_abort(upload_id):
+    upload = get_upload_session(upload_id)
+    if not upload:
+        return jsonify(error="Nie znaleziono przesyłanego pliku!"), 404
+    if os.path.exists(upload_part_path(upload)):
+        os.remove(upload_part_path(upload))
+    get_upload_hashes().discard(upload.id)
+    db.session.delete(upload)
+    db.session.commit()
+    return "", 204
+
 @bp.route("/delete-file", methods=["POST"])
 @login_required
 def delete_file():
@@ -241,7 +464,7 @@ def edit_post():
         assignable_tags = Tag.query.filter((Tag.is_restricted == False) | (Tag.allowed_users.any(id=current_user.id))).filter(Tag.id.in_(tags)).all()
         if(len(assignable_tags) > 5):
             flash("Możesz wybrać do 5 kategorii!", "error")
-            return render_template("edit-post.html", post=post, assignable_tags=get_assignable_tags())
+            return render_template("edit-post.html", post=post, assignable_tags=get_assignable_tags(), user_files=get_user_files())
         fileids = [int(fid) for fid in request.form.get("files", "").split(",") if fid.strip().isdigit()]
         files = File.query.filter(File.user_id == current_user.id, File.id.in_(fileids)).all()
         post.tags = assignable_tags
@@ -255,27 +478,21 @@ def edit_post():
         else:
             flash("Twoje zmiany zostały wysłane do weryfikacji.", "success")
         return redirect(url_for("panel.news"))
-    return render_template("edit-post.html", post=post, assignable_tags=get_assignable_tags())
+    return render_template("edit-post.html", post=post, assignable_tags=get_assignable_tags(), user_files=get_user_files())
 
 @bp.before_request
-def check_if_email_confirmed():
-    if current_user.is_authenticated and not current_user.email_confirmed and request.endpoint != "panel.profile":
-        return redirect(url_for("panel.profile"))
-    elif current_user.is_authenticated and not current_user.email_confirmed and request.endpoint == "panel.profile":
+def panel_gate():
+    if not current_user.is_authenticated:
+        return
+    if not current_user.email_confirmed:
+        if request.endpoint != "panel.profile":
+            return redirect(url_for("panel.profile"))
         flash(f"""Potwierdź swój adres email, klikając link w wysłanej wiadomoścni, aby korzystać z portalu! <a href="{url_for("auth.resend_confirmation_email")}" class="font-normal text-brand-500 underline">Wyślij wiadomość ponownie</a>""", category="warning")
-        
-@bp.before_request
-def check_reputation():
-    if current_user.is_authenticated and current_user.reputation < 40 and request.endpoint != "panel.panel_home":
-        return redirect(url_for("panel.panel_home"))
-    elif current_user.is_authenticated and current_user.reputation < 40 and request.endpoint == "panel.panel_home":
+    if current_user.reputation < 40:
+        if request.endpoint != "panel.panel_home":
+            return redirect(url_for("panel.panel_home"))
         flash("Niestety, ze względu na zbyt niską reputację nie możesz korzystać z portalu.", category="warning")
-        
-@bp.before_request
-def force_password_change():
-    if current_user.is_authenticated:
-        if current_user.force_password_change and current_user.reputation >= 40 and request.endpoint != "panel.profile":
+    elif current_user.force_password_change:
+        if request.endpoint != "panel.profile":
             return redirect(url_for("panel.profile"))
-    if current_user.is_authenticated:
-        if current_user.force_password_change and current_user.reputation >= 40 and request.endpoint == "panel.profile":
-            flash("Ze względów bezpieczeństwa, musisz teraz zmienić swoje hasło.", category="warning")
\ No newline at end of file
+        flash("Ze względów bezpieczeństwa, musisz teraz zmienić swoje hasło.", category="warning")
@@ -0,0 +1,47 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# scrypt and pbkdf2 release the GIL, so a small pool runs hashes in parallel while
+# the semaphore caps how many requests can wait for it; the rest get a 503 instead
+# of tying up every worker thread.
+class PasswordHasher:
+    def __init__(self, app):
+        self.method = app.config["PASSWORD_HASH_METHOD"]
+        self.timeout = app.config["PASSWORD_HASH_TIMEOUT"]
+        workers = app.config["PASSWORD_HASH_WORKERS"]
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="password-hash")
+        self.slots = threading.BoundedSemaphore(workers + app.config["PASSWORD_HASH_QUEUE"])
+        # the full parameter string (e.g. "scrypt:32768:8:1") as werkzeug writes it into the hash
+        self.prefix = generate_password_hash("", self.method).split("$", 1)[0]
+
+    def run(self, func, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise ServiceUnavailable("Serwer jest przeciążony, spróbuj ponownie za chwilę.", retry_after=5)
+        try:
+            return self.executor.submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self.run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        return pwhash.split("$", 1)[0] != self.prefix
+
+def init_password_hasher(app):
+    app.extensions["password_hasher"] = PasswordHasher(app)
+
+def hash_password(password):
+    return current_app.extensions["password_hasher"].hash(password)
+
+def check_password(pwhash, password):
+    return current_app.extensions["password_hasher"].check(pwhash, password)
+
+def needs_rehash(pwhash):
+    return current_app.extensions["password_hasher"].needs_rehash(pwhash)
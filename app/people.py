@@ -0,0 +1,100 @@
+import csv
+from datetime import datetime
+from sqlalchemy import select, insert, update, bindparam, func
+
+from app.extensions import db
+from app.models import Person, User
+
+PERSON_FIELDS = ("first_name", "last_name", "ldap_group")
+
+def read_people(path):
+    rows = {}
+    skipped = 0
+    with open(path, "r", newline="", encoding="utf-8-sig") as file:
+        for fields in csv.reader(file, delimiter=";"):
+            fields = [field.strip() for field in fields]
+            if len(fields) < 4 or not all(fields[:4]) or fields[0] in rows:
+                skipped += 1
+                continue
+            rows[fields[0]] = dict(login=fields[0], first_name=fields[1], last_name=fields[2], ldap_group=fields[3])
+    return rows, skipped
+
+def plan_people_sync(rows, remove_missing=True):
+    existing = {row.login: row for row in db.session.execute(select(Person.login, Person.left_at, *[getattr(Person, field) for field in PERSON_FIELDS]))}
+    added = [row for login, row in rows.items() if login not in existing]
+    changed = [
+        row for login, row in rows.items()
+        if login in existing and (existing[login].left_at is not None or any(getattr(existing[login], field) != row[field] for field in PERSON_FIELDS))
+    ]
+    removed = [login for login, row in existing.items() if login not in rows and row.left_at is None] if remove_missing else []
+    return added, changed, removed
+
+# Marking people as left locks their accounts, so a truncated or wrongly delimited file must not
+# be able to take out the whole school.
+def removal_refused(rows, removed, max_share):
+    if not removed:
+        return None
+    if not rows:
+        return "no valid rows were read from the file"
+    active = db.session.execute(select(func.count()).select_from(Person).where(Person.left_at == None)).scalar()
+    if len(removed) > active * max_share:
+        return f"{len(removed)} of {active} people would be marked as left (more than {max_share:.0%})"
+    return None
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def upsert_people(rows):
+    table = Person.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        # ON CONFLICT keeps the import idempotent even if someone adds the same login in the meantime
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        query = dialect_insert(table)
+        query = query.on_conflict_do_update(index_elements=[table.c.login], set_={**{field: query.excluded[field] for field in PERSON_FIELDS}, "left_at": None})
+        db.session.execute(query, rows)
+        return
+    logins = set(db.session.execute(select(table.c.login).where(table.c.login.in_([row["login"] for row in rows]))).scalars())
+    new = [row for row in rows if row["login"] not in logins]
+    old = [{"b_login": row["login"], **{field: row[field] for field in PERSON_FIELDS}} for row in rows if row["login"] in logins]
+    if new:
+        db.session.execute(insert(table), new)
+    if old:
+        db.session.execute(update(table).where(table.c.login == bindparam("b_login")).values(left_at=None), old)
+
+def sync_linked_users(logins):
+    # names and classes are copied onto the account at sign-up, so keep them in step with the roster
+    person = Person.__table__
+    users = User.__table__
+    match = person.c.id == users.c.person_id
+    db.session.execute(
+        update(users)
+        .where(users.c.person_id.in_(select(person.c.id).where(person.c.login.in_(logins))))
+        .values(
+            first_name=select(person.c.first_name).where(match).scalar_subquery(),
+            last_name=select(person.c.last_name).where(match).scalar_subquery(),
+            ldap_group=select(person.c.ldap_group).where(match).scalar_subquery(),
+            version=users.c.version + 1,
+        )
+    )
+
+def apply_people_sync(added, changed, removed, batch_size):
+    changed_logins = {row["login"] for row in changed}
+    for batch in chunks(added + changed, batch_size):
+        upsert_people(batch)
+        logins = [row["login"] for row in batch if row["login"] in changed_logins]
+        if logins:
+            sync_linked_users(logins)
+        db.session.commit()
+    now = datetime.utcnow()
+    for batch in chunks(removed, batch_size):
+        db.session.execute(update(Person).where(Person.login.in_(batch)).values(left_at=now))
+        # linked accounts stay (with their posts and files) but can no longer sign in; the version bump
+        # makes cached sessions reload and drop them
+        users = User.__table__
+        db.session.execute(update(users).where(users.c.person_id.in_(select(Person.id).where(Person.login.in_(batch)))).values(version=users.c.version + 1))
+        db.session.commit()
@@ -0,0 +1,95 @@
+import os
+import subprocess
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+
+from app.extensions import db
+from app.models import File, FilePreviewStatus
+from app.storage import get_storage, make_storage, storage_settings, file_key, preview_key
+
+def preview_name(file):
+    return preview_key(file_key(file))
+
+# Runs in the worker processes, so it must not touch the app, the session or the config.
+# Needs Pillow, and pdftoppm (poppler-utils) for PDFs; a missing tool marks the preview failed.
+def render_preview(settings, name, target, mimetype, max_size):
+    from PIL import Image
+
+    storage = make_storage(settings)
+    with tempfile.TemporaryDirectory() as tmp, storage.local_file(name) as source:
+        if mimetype == "application/pdf":
+            page = os.path.join(tmp, "page")
+            subprocess.run(
+                ["pdftoppm", "-f", "1", "-l", "1", "-singlefile", "-png", "-scale-to", str(max_size * 2), source, page],
+                check=True, capture_output=True, timeout=60
+            )
+            source = page + ".png"
+
+        with Image.open(source) as image:
+            image.seek(0)
+            image.thumbnail((max_size, max_size))
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+            partial = os.path.join(tmp, "preview.webp")
+            image.save(partial, "WEBP", quality=80)
+
+        storage.save(target, partial)
+
+class PreviewWorker:
+    def __init__(self, app):
+        self.app = app
+        self.workers = app.config["PREVIEW_WORKERS"]
+        self.max_size = app.config["PREVIEW_MAX_SIZE"]
+        self.settings = storage_settings(app.config)
+        self.executor = None
+        self.pid = None
+
+    def get_executor(self):
+        # gunicorn forks after create_app, so every worker process starts its own pool
+        if self.executor is None or self.pid != os.getpid():
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            self.pid = os.getpid()
+        return self.executor
+
+    def submit(self, file):
+        if not self.workers or file.preview_status != FilePreviewStatus.pending:
+            return None
+
+        name = preview_name(file)
+        if get_storage().exists(name):
+            self.finish(file.id, name, None)
+            return None
+
+        file_id = file.id
+        source = file_key(file)
+        future = self.get_executor().submit(render_preview, self.settings, source, name, file.mimetype, self.max_size)
+        future.add_done_callback(lambda future: self.finish(file_id, name, future.exception(), source))
+        return future
+
+    def finish(self, file_id, name, error, source=None):
+        with self.app.app_context():
+            try:
+                file = db.session.get(File, file_id)
+                if file is None:
+                    # deleted while rendering; drop the preview unless the content is still stored for another file
+                    storage = get_storage()
+                    if source and not storage.exists(source):
+                        storage.delete(name)
+                    return
+                if error is None:
+                    file.preview = name
+                    file.preview_status = FilePreviewStatus.ready
+                else:
+                    self.app.logger.warning("Generating preview for file %s failed: %s", file_id, error)
+                    file.preview_status = FilePreviewStatus.failed
+                db.session.commit()
+            finally:
+                db.session.remove()
+
+def init_preview_worker(app):
+    app.extensions["preview_worker"] = PreviewWorker(app)
+
+def schedule_preview(file):
+    return current_app.extensions["preview_worker"].submit(file)
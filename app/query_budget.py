@@ -0,0 +1,35 @@
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+from app.extensions import db
+
+def query_budget(limit):
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+def init_query_budget(app):
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and "query_count" in g:
+            g.query_count += 1
+
+    @app.before_request
+    def reset_query_count():
+        g.query_count = 0
+
+    @app.after_request
+    def check_query_budget(response):
+        if not app.testing:
+            return response
+        view = app.view_functions.get(request.endpoint)
+        limit = getattr(view, "query_budget", app.config.get("SQL_QUERY_BUDGET"))
+        count = g.get("query_count", 0)
+        response.headers["X-Query-Count"] = str(count)
+        if limit is not None and count > limit:
+            raise AssertionError(f"{request.endpoint} executed {count} SQL queries, budget is {limit}")
+        return response
@@ -0,0 +1,42 @@
+import threading
+from bleach.sanitizer import Cleaner
+
+# Bump whenever the output of PostRenderer changes, then run "manage.py rerender-posts".
+RENDERER_VERSION = 1
+
+class PostRenderer:
+    version = RENDERER_VERSION
+
+    def __init__(self):
+        self.local = threading.local()
+
+    @property
+    def cleaner(self):
+        # bleach cleaners keep parser state, so each thread gets its own
+        cleaner = getattr(self.local, "cleaner", None)
+        if cleaner is None:
+            cleaner = Cleaner(
+                tags=["a"],
+                attributes={
+                    "a": ["href"]
+                },
+                protocols=["http", "https"],
+                strip=True
+            )
+            self.local.cleaner = cleaner
+        return cleaner
+
+    def sanitize(self, text):
+        return self.cleaner.clean(text)
+
+    def render(self, content):
+        return self.sanitize(content).replace("\n", "<br>")
+
+renderer = PostRenderer()
+
+def sanitize_html(text):
+    return renderer.sanitize(text)
+
+def render_post(post):
+    post.rendered_html = renderer.render(post.content)
+    post.renderer_version = renderer.version
@@ -0,0 +1,281 @@
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import current_app
+from sqlalchemy import update, delete
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+
+CHUNK_SIZE = 64 * 1024
+
+def sorted_dirs(path):
+    with os.scandir(path) as entries:
+        return sorted(entry.path for entry in entries if entry.is_dir() and re.fullmatch(r"[0-9a-f]{2}", entry.name))
+
+# Storage backends only get plain settings, so the preview workers can build their own.
+class LocalStorage:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def shard(self, name):
+        prefix = name[:4] if re.fullmatch(r"[0-9a-f]{4}", name[:4]) else hashlib.sha256(name.encode()).hexdigest()[:4]
+        return os.path.join(prefix[:2], prefix[2:])
+
+    def sharded_path(self, name):
+        return os.path.join(self.root, self.shard(name), name)
+
+    def flat_path(self, name):
+        return os.path.join(self.root, name)
+
+    def local_path(self, name):
+        # files that migrate-uploads has not moved yet are still read from the flat layout
+        path = self.sharded_path(name)
+        if not os.path.exists(path) and os.path.exists(self.flat_path(name)):
+            return self.flat_path(name)
+        return path
+
+    def relative_path(self, name):
+        return os.path.relpath(self.local_path(name), self.root).replace(os.sep, "/")
+
+    def exists(self, name):
+        return os.path.exists(self.sharded_path(name)) or os.path.exists(self.flat_path(name))
+
+    def save(self, name, temp_path):
+        path = self.sharded_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(temp_path, path)
+        except OSError:
+            # temp_path is on another filesystem; copy next to the target first so the rename stays atomic
+            partial = f"{path}.{uuid.uuid4().hex}.part"
+            shutil.copyfile(temp_path, partial)
+            os.replace(partial, path)
+            os.remove(temp_path)
+
+    def delete(self, name):
+        for path in (self.sharded_path(name), self.flat_path(name)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @contextmanager
+    def local_file(self, name):
+        yield self.local_path(name)
+
+    def url(self, name, mimetype=None):
+        return None
+
+    def flat_names(self):
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith("."):
+                    yield entry.name
+
+    def iter_files(self):
+        # hex names live under their own prefix, so walking the shards in order yields them sorted;
+        # flat and hash-sharded names come out of order and fsck checks those one by one
+        for first in sorted_dirs(self.root):
+            for second in sorted_dirs(first):
+                with os.scandir(second) as entries:
+                    files = sorted((entry.name, entry.stat().st_mtime) for entry in entries if entry.is_file() and not entry.name.endswith(".part"))
+                yield from files
+        for name in self.flat_names():
+            yield name, os.stat(self.flat_path(name)).st_mtime
+
+class S3Storage:
+    def __init__(self, bucket, prefix="", endpoint_url=None, region=None, url_expires=3600):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.url_expires = url_expires
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+
+    def key(self, name):
+        return self.prefix + name
+
+    def local_path(self, name):
+        return None
+
+    def exists(self, name):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def upload(self, name, path):
+        self.client.upload_file(path, self.bucket, self.key(name))
+
+    def save(self, name, temp_path):
+        self.upload(name, temp_path)
+        os.remove(temp_path)
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    @contextmanager
+    def local_file(self, name):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, name)
+            self.client.download_file(self.bucket, self.key(name), path)
+            yield path
+
+    def iter_files(self):
+        # S3 lists keys in lexicographic order
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                yield item["Key"][len(self.prefix):], item["LastModified"].timestamp()
+
+    def url(self, name, mimetype=None):
+        params = {"Bucket": self.bucket, "Key": self.key(name)}
+        if mimetype:
+            params["ResponseContentType"] = mimetype
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=self.url_expires)
+
+def storage_settings(config):
+    return {
+        "backend": config["STORAGE_BACKEND"],
+        "root": config.get("UPLOAD_FOLDER") or os.path.join(os.path.dirname(__file__), "uploads"),
+        "bucket": config["S3_BUCKET"],
+        "prefix": config["S3_PREFIX"],
+        "endpoint_url": config["S3_ENDPOINT_URL"],
+        "region": config["S3_REGION"],
+        "url_expires": config["S3_URL_EXPIRES"],
+    }
+
+def make_storage(settings):
+    if settings["backend"] == "local":
+        return LocalStorage(settings["root"])
+    if settings["backend"] == "s3":
+        return S3Storage(settings["bucket"], settings["prefix"], settings["endpoint_url"], settings["region"], settings["url_expires"])
+    raise ValueError(f"Unknown STORAGE_BACKEND: {settings['backend']}")
+
+def init_storage(app):
+    settings = storage_settings(app.config)
+    os.makedirs(settings["root"], exist_ok=True)
+    app.extensions["itos_storage"] = make_storage(settings)
+    app.extensions["upload_hashes"] = UploadHashes(app.config["UPLOAD_HASH_STATES"])
+
+def get_storage():
+    return current_app.extensions["itos_storage"]
+
+def upload_folder():
+    return os.path.abspath(storage_settings(current_app.config)["root"])
+
+def temp_upload_path():
+    return os.path.join(upload_folder(), f".{uuid.uuid4().hex}.part")
+
+def file_key(file):
+    # files uploaded before content addressing are still stored under their own filename
+    return file.blob_sha256 or file.filename
+
+def preview_key(key):
+    return f"{key}.preview.webp"
+
+def save_hashed(stream, path):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as f:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+# hashlib state cannot be saved with the upload session, so each worker keeps the running sha256 of the
+# chunked uploads it has written to. A worker that missed chunks (or restarted) reads just the missing
+# range of the .part file, so finalize normally hashes nothing.
+class UploadHashes:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    # sha256 of the first `offset` bytes of the upload; the caller owns it until it calls set()
+    def take(self, upload_id, offset, path):
+        with self.lock:
+            entry = self.entries.pop(upload_id, None)
+        position, digest = entry if entry is not None and entry[0] <= offset else (0, hashlib.sha256())
+        if position < offset:
+            with open(path, "rb") as f:
+                f.seek(position)
+                while position < offset:
+                    chunk = f.read(min(CHUNK_SIZE, offset - position))
+                    if not chunk:
+                        raise OSError(f"{path} is shorter than {offset} bytes")
+                    digest.update(chunk)
+                    position += len(chunk)
+        return digest
+
+    def set(self, upload_id, offset, digest):
+        with self.lock:
+            self.entries[upload_id] = (offset, digest)
+            self.entries.move_to_end(upload_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, upload_id):
+        with self.lock:
+            self.entries.pop(upload_id, None)
+
+def get_upload_hashes():
+    return current_app.extensions["upload_hashes"]
+
+def blob_exists(digest):
+    from app.models import Blob
+    return db.session.get(Blob, digest) is not None
+
+def charged_size(digest, size):
+    if current_app.config["QUOTA_COUNT_DEDUPLICATED"] or not blob_exists(digest):
+        return size
+    return 0
+
+def acquire_blob(digest, size):
+    from app.models import Blob, StorageTombstone
+
+    result = db.session.execute(update(Blob).where(Blob.sha256 == digest).values(refcount=Blob.refcount + 1))
+    if result.rowcount == 0:
+        try:
+            with db.session.begin_nested():
+                db.session.add(Blob(sha256=digest, size=size, refcount=1))
+        except IntegrityError:
+            db.session.execute(update(Blob).where(Blob.sha256 == digest).values(refcount=Blob.refcount + 1))
+        else:
+            # the same content was deleted recently; take it back from the sweeper (this waits for a sweep in progress)
+            db.session.execute(delete(StorageTombstone).where(StorageTombstone.name.in_([digest, preview_key(digest)])))
+
+def put_blob(temp_path, digest):
+    storage = get_storage()
+    if storage.exists(digest):
+        os.remove(temp_path)
+    else:
+        storage.save(digest, temp_path)
+
+def discard_blob(digest):
+    from app.models import StorageTombstone
+
+    # the commit that was to reference the blob failed; the sweeper deletes it unless something references it by then
+    db.session.add(StorageTombstone(name=digest))
+    db.session.info["storage_tombstones"] = True
+
+def release_blob(connection, digest):
+    from app.models import Blob
+
+    table = Blob.__table__
+    connection.execute(update(table).where(table.c.sha256 == digest).values(refcount=table.c.refcount - 1))
+    result = connection.execute(delete(table).where(table.c.sha256 == digest, table.c.refcount <= 0))
+    return result.rowcount > 0
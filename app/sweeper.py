@@ -0,0 +1,93 @@
+import os
+import threading
+from flask import current_app
+from sqlalchemy import select, delete, update, exists, or_, and_
+
+from app.extensions import db
+from app.models import File, Blob, StorageTombstone
+from app.storage import get_storage
+
+def is_referenced(name):
+    return db.session.execute(select(or_(
+        exists().where(Blob.sha256 == name),
+        exists().where(and_(File.filename == name, File.blob_sha256 == None)),
+        exists().where(File.preview == name),
+    ))).scalar()
+
+def sweep_tombstone(tombstone_id, name):
+    # deleting the tombstone first locks it, so an upload reclaiming the same content waits for this sweep to finish
+    if db.session.execute(delete(StorageTombstone).where(StorageTombstone.id == tombstone_id)).rowcount == 0:
+        db.session.rollback()
+        return False
+    try:
+        if not is_referenced(name):
+            get_storage().delete(name)
+    except Exception:
+        current_app.logger.exception("Deleting %s from storage failed", name)
+        db.session.rollback()
+        db.session.execute(update(StorageTombstone).where(StorageTombstone.id == tombstone_id).values(attempts=StorageTombstone.attempts + 1))
+        db.session.commit()
+        return False
+    db.session.commit()
+    return True
+
+def sweep_tombstones(batch_size, max_attempts):
+    rows = db.session.execute(
+        select(StorageTombstone.id, StorageTombstone.name).where(StorageTombstone.attempts < max_attempts).order_by(StorageTombstone.id).limit(batch_size)
+    ).all()
+    db.session.rollback()
+    swept = 0
+    for row in rows:
+        swept += sweep_tombstone(row.id, row.name)
+    return len(rows), swept
+
+# One sweeper thread per worker process; commits that queue tombstones wake it up,
+# the interval picks up whatever other processes left behind.
+class StorageSweeper:
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config["STORAGE_SWEEP_INTERVAL"]
+        self.batch_size = app.config["STORAGE_SWEEP_BATCH"]
+        self.max_attempts = app.config["STORAGE_SWEEP_MAX_ATTEMPTS"]
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        if not self.interval:
+            return
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            self.thread = threading.Thread(target=self.run, name="storage-sweeper", daemon=True)
+            self.pid = os.getpid()
+            self.thread.start()
+
+    def wake(self):
+        self.start()
+        self.event.set()
+
+    def run(self):
+        while True:
+            self.event.wait(self.interval)
+            self.event.clear()
+            try:
+                self.sweep()
+            except Exception:
+                self.app.logger.exception("Sweeping deleted uploads failed")
+
+    def sweep(self):
+        with self.app.app_context():
+            try:
+                while True:
+                    found, swept = sweep_tombstones(self.batch_size, self.max_attempts)
+                    if found < self.batch_size or not swept:
+                        return
+            finally:
+                db.session.remove()
+
+def init_storage_sweeper(app):
+    sweeper = StorageSweeper(app)
+    app.extensions["storage_sweeper"] = sweeper
+    app.before_request(sweeper.start)
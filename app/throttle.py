@@ -0,0 +1,64 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+from flask import current_app, request, flash, make_response, render_template
+from werkzeug.utils import import_string
+
+class MemoryBucketStore:
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key, rate, burst):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            # idle buckets have refilled anyway, so dropping the oldest ones loses nothing that matters
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+            return wait
+
+# Any object with consume(key, rate, burst) -> seconds to wait (0 when allowed) can be
+# plugged in through THROTTLE_BACKEND, e.g. a redis script shared by all workers.
+class Throttle:
+    def __init__(self, store, limits):
+        self.store = store
+        self.limits = limits
+
+    def wait(self, scope, account=None):
+        ip_rate, ip_burst = self.limits["ip"]
+        wait = self.store.consume(f"{scope}:ip:{request.remote_addr}", ip_rate, ip_burst)
+        if account:
+            account_rate, account_burst = self.limits["account"]
+            wait = max(wait, self.store.consume(f"{scope}:account:{account.strip().lower()}", account_rate, account_burst))
+        return math.ceil(wait)
+
+def init_throttle(app):
+    backend = app.config["THROTTLE_BACKEND"]
+    if backend == "memory":
+        store = MemoryBucketStore(app.config["THROTTLE_MAX_KEYS"])
+    else:
+        store = import_string(backend)(app)
+    limits = {
+        "ip": (app.config["THROTTLE_IP_PER_MINUTE"] / 60, app.config["THROTTLE_IP_BURST"]),
+        "account": (app.config["THROTTLE_ACCOUNT_PER_MINUTE"] / 60, app.config["THROTTLE_ACCOUNT_BURST"]),
+    }
+    app.extensions["throttle"] = Throttle(store, limits)
+
+def throttle_wait(scope, account=None):
+    return current_app.extensions["throttle"].wait(scope, account)
+
+def throttled_response(template, wait, **context):
+    flash(f"Zbyt wiele prób. Spróbuj ponownie za {wait} s.", "error")
+    resp = make_response(render_template(template, **context), 429)
+    resp.headers["Retry-After"] = str(wait)
+    return resp
@@ -0,0 +1,108 @@
+import time
+import threading
+from collections import OrderedDict
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import select
+
+from app.extensions import db
+from app.models import User, Person
+
+SNAPSHOT_COLUMNS = (
+    "id", "email", "email_confirmed", "first_name", "last_name", "ldap_group", "role",
+    "quota", "bytes_used", "reputation", "force_password_change", "version",
+)
+
+# What load_user hands to flask-login: the columns the panel gate, the templates and the
+# admin checks read on every request. Anything else (password_hash, posts, files, ...)
+# falls through to the real User row, loaded on first use within the request.
+class UserSnapshot(UserMixin):
+    def __init__(self, row):
+        for column in SNAPSHOT_COLUMNS:
+            setattr(self, column, getattr(row, column))
+
+    @property
+    def space_used(self):
+        return self.bytes_used
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name in SNAPSHOT_COLUMNS:
+            raise AttributeError(name)
+        return getattr(db.session.get(User, self.id), name)
+
+    def __repr__(self):
+        return f"{self.first_name} {self.last_name} ({self.email})"
+
+# Snapshots are trusted for `ttl` seconds; after that a one-column version query decides
+# whether the cached snapshot is still current. Commits in this process drop the entry
+# right away, other workers catch up within `ttl`.
+class UserCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None:
+                self.entries.move_to_end(user_id)
+        now = time.monotonic()
+        if entry is not None and entry[0] >= now:
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            version = db.session.execute(select(User.version).where(User.id == user_id)).scalar()
+            if version == entry[1].version:
+                self.revalidated += 1
+                self.set(user_id, entry[1])
+                return entry[1]
+        self.misses += 1
+        # accounts whose school person has left load as missing, which signs their sessions out
+        row = db.session.execute(
+            select(*[getattr(User, column) for column in SNAPSHOT_COLUMNS])
+            .outerjoin(Person, Person.id == User.person_id)
+            .where(User.id == user_id, Person.left_at == None)
+        ).first()
+        if row is None:
+            self.delete(user_id)
+            return None
+        snapshot = UserSnapshot(row)
+        self.set(user_id, snapshot)
+        return snapshot
+
+    def set(self, user_id, snapshot):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl, snapshot)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.revalidated + self.misses
+            return {
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.revalidated) / requests, 3) if requests else None,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+            }
+
+def init_user_cache(app):
+    app.extensions["user_cache"] = UserCache(app.config["USER_CACHE_SIZE"], app.config["USER_CACHE_TTL"])
+
+def get_user_cache():
+    return current_app.extensions["user_cache"]
+
+def load_user_snapshot(user_id):
+    return get_user_cache().get(user_id)
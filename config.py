@@ -13,7 +13,41 @@ class Config:
         os.environ.get("SQLALCHEMY_TRACK_MODIFICATIONS", "false").lower() == "true"
     )
 
+    SQL_QUERY_BUDGET = int(os.environ["SQL_QUERY_BUDGET"]) if os.environ.get("SQL_QUERY_BUDGET") else None
+
+    BOARD_CACHE_BACKEND = os.environ.get("BOARD_CACHE_BACKEND", "memory")
+    BOARD_CACHE_MAX_BYTES = int(os.environ.get("BOARD_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+    BOARD_CACHE_TIMEOUT = int(os.environ.get("BOARD_CACHE_TIMEOUT", 24 * 60 * 60))
+    FILE_CACHE_SIZE = int(os.environ.get("FILE_CACHE_SIZE", 2048))
+    FILE_CACHE_TTL = int(os.environ.get("FILE_CACHE_TTL", 30))
+    USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 4096))
+    USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 15))
+    ADMIN_EXPORT_CHUNK_SIZE = int(os.environ.get("ADMIN_EXPORT_CHUNK_SIZE", 500))
+
+    FEED_SIZE = int(os.environ.get("FEED_SIZE", 20))
+
+    SSE_POLL_INTERVAL = float(os.environ.get("SSE_POLL_INTERVAL", 2))
+    SSE_KEEPALIVE = int(os.environ.get("SSE_KEEPALIVE", 15))
+    SSE_BUFFER_SIZE = int(os.environ.get("SSE_BUFFER_SIZE", 1000))
+    SSE_EVENT_RETENTION = int(os.environ.get("SSE_EVENT_RETENTION", 24 * 60 * 60))
+    SSE_GAP_TIMEOUT = float(os.environ.get("SSE_GAP_TIMEOUT", 5))
+
+    SEARCH_DICTIONARIES = os.environ.get("SEARCH_DICTIONARIES", "unaccent,simple").split(",")
+
     UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER")
+    STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")
+    # the s3 backend needs boto3, which is an optional dependency and not in requirements.txt
+    S3_BUCKET = os.environ.get("S3_BUCKET")
+    S3_PREFIX = os.environ.get("S3_PREFIX", "uploads/")
+    S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+    S3_REGION = os.environ.get("S3_REGION")
+    S3_URL_EXPIRES = int(os.environ.get("S3_URL_EXPIRES", 3600))
+    STORAGE_SWEEP_INTERVAL = int(os.environ.get("STORAGE_SWEEP_INTERVAL", 60))
+    STORAGE_SWEEP_BATCH = int(os.environ.get("STORAGE_SWEEP_BATCH", 100))
+    STORAGE_SWEEP_MAX_ATTEMPTS = int(os.environ.get("STORAGE_SWEEP_MAX_ATTEMPTS", 10))
+
+    FILE_OFFLOAD_MODE = os.environ.get("FILE_OFFLOAD_MODE", "direct")
+    FILE_OFFLOAD_PREFIX = os.environ.get("FILE_OFFLOAD_PREFIX", "/protected-uploads/")
 
     MAIL_SERVER = os.environ.get("MAIL_SERVER")
     MAIL_PORT = int(os.environ.get("MAIL_PORT", 587))
@@ -28,5 +62,43 @@ class Config:
     )
 
     MAIL_MAX_EMAILS = int(os.environ.get("MAIL_MAX_EMAILS", 3))
+    MAIL_OUTBOX_BATCH = int(os.environ.get("MAIL_OUTBOX_BATCH", 50))
+    MAIL_OUTBOX_LEASE = int(os.environ.get("MAIL_OUTBOX_LEASE", 300))
+    MAIL_RETRY_BASE = int(os.environ.get("MAIL_RETRY_BASE", 60))
+    MAIL_RETRY_MAX = int(os.environ.get("MAIL_RETRY_MAX", 6 * 60 * 60))
+    MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", 8))
+    MAIL_WORKER_INTERVAL = int(os.environ.get("MAIL_WORKER_INTERVAL", 5))
+    # seconds between messages, so digest batches go out throttled; the worker renews its lease as it goes
+    MAIL_SEND_PAUSE = float(os.environ.get("MAIL_SEND_PAUSE", 1))
+    MAIL_DIGEST_BCC_SIZE = int(os.environ.get("MAIL_DIGEST_BCC_SIZE", 50))
+    MAIL_DIGEST_MAX_POSTS = int(os.environ.get("MAIL_DIGEST_MAX_POSTS", 30))
+    SITE_URL = os.environ.get("SITE_URL", "http://localhost:5000")
     
     MAX_CONTENT_LENGTH = 64 * 1024 * 1024 
+
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE", 8))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get("PASSWORD_HASH_TIMEOUT", 5))
+
+    # Number of reverse proxies in front of the app (e.g. 1 behind nginx). Their X-Forwarded-For and
+    # X-Forwarded-Proto are trusted for that many hops, so request.remote_addr is the client address the
+    # per-IP throttle keys on; with 0 every client behind the proxy shares the proxy's address.
+    PROXY_FIX_X_FOR = int(os.environ.get("PROXY_FIX_X_FOR", 0))
+    PROXY_FIX_X_PROTO = int(os.environ.get("PROXY_FIX_X_PROTO", 0))
+
+    THROTTLE_BACKEND = os.environ.get("THROTTLE_BACKEND", "memory")
+    THROTTLE_MAX_KEYS = int(os.environ.get("THROTTLE_MAX_KEYS", 100000))
+    THROTTLE_IP_PER_MINUTE = int(os.environ.get("THROTTLE_IP_PER_MINUTE", 30))
+    THROTTLE_IP_BURST = int(os.environ.get("THROTTLE_IP_BURST", 10))
+    THROTTLE_ACCOUNT_PER_MINUTE = int(os.environ.get("THROTTLE_ACCOUNT_PER_MINUTE", 5))
+    THROTTLE_ACCOUNT_BURST = int(os.environ.get("THROTTLE_ACCOUNT_BURST", 5))
+
+    UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 4 * 1024 * 1024))
+    UPLOAD_SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL", 24 * 60 * 60))
+    UPLOAD_CLAIM_TIMEOUT = int(os.environ.get("UPLOAD_CLAIM_TIMEOUT", 10 * 60))
+    UPLOAD_HASH_STATES = int(os.environ.get("UPLOAD_HASH_STATES", 1000))
+    QUOTA_COUNT_DEDUPLICATED = os.environ.get("QUOTA_COUNT_DEDUPLICATED", "true").lower() == "true"
+
+    PREVIEW_WORKERS = int(os.environ.get("PREVIEW_WORKERS", 2))
+    PREVIEW_MAX_SIZE = int(os.environ.get("PREVIEW_MAX_SIZE", 320))
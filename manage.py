@@ -1,10 +1,11 @@
 import os
+import click
 from flask.cli import FlaskGroup
-from werkzeug.security import generate_password_hash
+from app.passwords import hash_password
 
 from app import create_app
 from app.extensions import db
-from app.models import Person, User, UserRole
+from app.models import User, UserRole, Post, File, FilePreviewStatus, PREVIEW_MIMETYPES, Blob, StorageTombstone
 
 def create_app_cli():
     return create_app()
@@ -18,7 +19,7 @@ def add_superadmin_user():
 
     admin_user = User(
         email=email,
-        password_hash=generate_password_hash(password),
+        password_hash=hash_password(password),
         role=UserRole.superadmin,
         person=None,
         quota=1024,
@@ -36,30 +37,346 @@ def add_superadmin_user():
     print("Superadmin user created")
 
 @cli.command("import-people")
-def import_people():
-    count_imported = 0
-    count_skipped = 0
+@click.option("--file", "path", default="people-to-import.csv", show_default=True, help="Semicolon separated login;first name;last name;group.")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows written per transaction.")
+@click.option("--keep-missing", is_flag=True, help="Do not mark people missing from the file as having left.")
+@click.option("--max-removed-share", default=0.3, show_default=True, help="Refuse to mark more than this share of current people as left.")
+@click.option("--force", is_flag=True, help="Mark missing people as left even if the file is empty or too many would go.")
+@click.option("--dry-run", is_flag=True, help="Only report what would change.")
+def import_people(path, batch_size, keep_missing, max_removed_share, force, dry_run):
+    from app.people import read_people, plan_people_sync, removal_refused, apply_people_sync
+
+    rows, count_skipped = read_people(path)
+    added, changed, removed = plan_people_sync(rows, remove_missing=not keep_missing)
+    refused = None if force else removal_refused(rows, removed, max_removed_share)
+    if refused and not dry_run:
+        raise click.ClickException(f"Refusing to sync: {refused}. Check the file ({count_skipped} lines skipped), or pass --keep-missing or --force.")
+    if not dry_run:
+        apply_people_sync(added, changed, removed, batch_size)
+    prefix = "Would sync" if dry_run else "Synced"
+    print(f"{prefix} {len(rows)} people: {len(added)} added, {len(changed)} changed, {len(removed)} removed, {len(rows) - len(added) - len(changed)} unchanged, {count_skipped} lines skipped")
+    if refused:
+        print(f"Without --force this would be refused: {refused}")
+
+@cli.command("rerender-posts")
+@click.option("--batch-size", default=500, show_default=True, help="Posts rendered per transaction.")
+@click.option("--all", "rerender_all", is_flag=True, help="Re-render posts that are already at the current renderer version.")
+def rerender_posts(batch_size, rerender_all):
+    from app.render import render_post, renderer
+
+    count_rendered = 0
+    last_id = 0
+
+    while True:
+        query = Post.query.filter(Post.id > last_id)
+        if not rerender_all:
+            query = query.filter((Post.renderer_version == None) | (Post.renderer_version != renderer.version))
+        batch = query.order_by(Post.id).limit(batch_size).all()
+        if not batch:
+            break
+
+        for post in batch:
+            render_post(post)
+        last_id = batch[-1].id
+        count_rendered += len(batch)
+
+        db.session.commit()
+        db.session.expunge_all()
+
+    print(f"{count_rendered} posts rendered with renderer version {renderer.version}")
+
+@cli.command("setup-search")
+def setup_search():
+    from flask import current_app
+    from app.main.search import install_search
+
+    with db.engine.begin() as connection:
+        installed = install_search(connection, current_app.config["SEARCH_DICTIONARIES"])
+
+    if installed:
+        print(f"Full-text search index installed for {db.engine.dialect.name}")
+    else:
+        print(f"Full-text search is not supported on {db.engine.dialect.name}, falling back to ILIKE")
+
+@cli.command("generate-previews")
+@click.option("--batch-size", default=100, show_default=True, help="Files rendered per transaction.")
+@click.option("--workers", default=None, type=int, help="Worker processes (defaults to PREVIEW_WORKERS).")
+@click.option("--all", "regenerate_all", is_flag=True, help="Also regenerate previews that are ready or failed.")
+def generate_previews(batch_size, workers, regenerate_all):
+    from concurrent.futures import ProcessPoolExecutor
+    from flask import current_app
+    from app.previews import render_preview, preview_name
+    from app.storage import get_storage, storage_settings, file_key
 
-    with open("people-to-import.csv", "r") as file:
-        for line in file:
-            data = line.strip().split(";")
+    count_ready = 0
+    count_failed = 0
+    last_id = 0
+    max_size = current_app.config["PREVIEW_MAX_SIZE"]
+    settings = storage_settings(current_app.config)
+    storage = get_storage()
 
-            if Person.query.filter_by(login=data[0]).first():
+    with ProcessPoolExecutor(workers or current_app.config["PREVIEW_WORKERS"] or 1) as executor:
+        while True:
+            query = File.query.filter(File.id > last_id, File.mimetype.in_(PREVIEW_MIMETYPES))
+            if not regenerate_all:
+                query = query.filter((File.preview_status == None) | (File.preview_status == FilePreviewStatus.pending))
+            batch = query.order_by(File.id).limit(batch_size).all()
+            if not batch:
+                break
+
+            futures = {}
+            for file in batch:
+                name = preview_name(file)
+                if name in futures:
+                    continue
+                if storage.exists(name) and not regenerate_all:
+                    futures[name] = None
+                else:
+                    futures[name] = executor.submit(render_preview, settings, file_key(file), name, file.mimetype, max_size)
+
+            for file in batch:
+                future = futures[preview_name(file)]
+                if future is None or future.exception() is None:
+                    file.preview = preview_name(file)
+                    file.preview_status = FilePreviewStatus.ready
+                    count_ready += 1
+                else:
+                    print(f"{file.filename}: {future.exception()}")
+                    file.preview_status = FilePreviewStatus.failed
+                    count_failed += 1
+            last_id = batch[-1].id
+
+            db.session.commit()
+            db.session.expunge_all()
+
+    print(f"{count_ready} previews generated, {count_failed} failed")
+
+@cli.command("migrate-uploads")
+@click.option("--target", type=click.Choice(["local", "s3"]), default=None, help="Storage backend to migrate to (defaults to STORAGE_BACKEND).")
+@click.option("--batch-size", default=500, show_default=True, help="Files moved between pauses.")
+@click.option("--pause", default=0.5, show_default=True, help="Seconds to sleep between batches.")
+@click.option("--remove-local", is_flag=True, help="Delete the local file after uploading it to S3.")
+def migrate_uploads(target, batch_size, pause, remove_local):
+    import time
+    from flask import current_app
+    from app.storage import LocalStorage, make_storage, storage_settings
+
+    settings = storage_settings(current_app.config)
+    if target:
+        settings["backend"] = target
+    source = LocalStorage(settings["root"])
+    storage = make_storage(settings)
+
+    count_moved = 0
+    count_skipped = 0
+    if isinstance(storage, LocalStorage):
+        names = list(source.flat_names())
+    else:
+        # files already moved to the sharded layout have to be uploaded as well
+        names = list(dict.fromkeys(name for name, mtime in source.iter_files()))
+
+    for start in range(0, len(names), batch_size):
+        for name in names[start:start + batch_size]:
+            if isinstance(storage, LocalStorage):
+                # os.replace is atomic, so the file is always readable from one of the two layouts
+                storage.save(name, source.flat_path(name))
+                count_moved += 1
+            elif storage.exists(name):
+                if remove_local:
+                    source.delete(name)
                 count_skipped += 1
-                continue
+            else:
+                storage.upload(name, source.local_path(name))
+                if remove_local:
+                    source.delete(name)
+                count_moved += 1
+        print(f"{min(start + batch_size, len(names))}/{len(names)} files processed")
+        time.sleep(pause)
 
-            newperson = Person(
-                login=data[0],
-                first_name=data[1],
-                last_name=data[2],
-                ldap_group=data[3]
-            )
+    print(f"{count_moved} files migrated to {settings['backend']} storage, {count_skipped} already there")
 
-            db.session.add(newperson)
-            count_imported += 1
+@cli.command("reconcile-quota")
+@click.option("--dry-run", is_flag=True, help="Only report drift, do not fix the counters.")
+def reconcile_quota(dry_run):
+    from sqlalchemy import select, update, func
 
+    actual = (
+        select(File.user_id, func.sum(func.coalesce(File.charged_size, File.size, 0)).label("bytes"))
+        .group_by(File.user_id)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(User.id, User.email, User.bytes_used, func.coalesce(actual.c.bytes, 0))
+        .outerjoin(actual, actual.c.user_id == User.id)
+        .where(User.bytes_used != func.coalesce(actual.c.bytes, 0))
+        .order_by(User.id)
+    ).all()
+
+    count_fixed = 0
+    for user_id, email, bytes_used, bytes_actual in rows:
+        print(f"{email}: counter {bytes_used}, files {bytes_actual} (drift {bytes_used - bytes_actual:+d})")
+        if dry_run:
+            continue
+        # recompute in the UPDATE itself and only if no upload moved the counter since the report
+        recomputed = select(func.coalesce(func.sum(func.coalesce(File.charged_size, File.size, 0)), 0)).where(File.user_id == user_id).scalar_subquery()
+        result = db.session.execute(update(User).where(User.id == user_id, User.bytes_used == bytes_used).values(bytes_used=recomputed))
+        count_fixed += result.rowcount
+        db.session.commit()
+
+    print(f"{len(rows)} users with drift, {count_fixed} fixed")
+
+@cli.command("fsck-uploads")
+@click.option("--grace", default=3600, show_default=True, help="Ignore stored files younger than this many seconds (uploads in flight).")
+@click.option("--delete-orphans", is_flag=True, help="Queue stored files without a database row for deletion.")
+@click.option("--remove-dangling", is_flag=True, help="Delete File rows whose content is missing and reset missing previews.")
+@click.option("--batch-size", default=1000, show_default=True, help="Names resolved and acted on per batch.")
+def fsck_uploads(grace, delete_orphans, remove_dangling, batch_size):
+    import time
+    from sqlalchemy import select, union, literal, insert
+    from app.storage import get_storage
+    from app.sweeper import is_referenced
+
+    storage = get_storage()
+    cutoff = time.time() - grace
+
+    names = union(
+        select(Blob.sha256.label("name"), literal("blob").label("kind")),
+        select(File.filename.label("name"), literal("file").label("kind")).where(File.blob_sha256 == None),
+        select(File.preview.label("name"), literal("preview").label("kind")).where(File.preview != None),
+    ).subquery()
+    order = names.c.name.collate("C") if db.engine.dialect.name == "postgresql" else names.c.name
+    expected = iter(db.session.execute(select(names.c.name, names.c.kind).order_by(order).execution_options(yield_per=batch_size)))
+    stored = storage.iter_files()
+
+    # candidates are resolved every batch_size names, so memory stays flat however many files are off;
+    # everything runs in one transaction because committing would close the streaming cursor
+    orphans = []
+    dangling = []
+    unordered = []
+    counts = {"checked": 0, "orphans": 0, "dangling": 0}
+
+    def flush_orphans():
+        for name in orphans:
+            print(f"orphan: {name}")
+        if delete_orphans and orphans:
+            db.session.execute(insert(StorageTombstone), [{"name": name} for name in orphans])
+            db.session.info["storage_tombstones"] = True
+        counts["orphans"] += len(orphans)
+        orphans.clear()
+
+    # names that were not in shard order get a direct lookup instead
+    def resolve_unordered():
+        orphans.extend(name for name, mtime in unordered if mtime < cutoff and not is_referenced(name))
+        unordered.clear()
+        flush_orphans()
+
+    # rows that look dangling may still exist in storage out of shard order
+    def resolve_dangling():
+        for name, kind in dangling:
+            if storage.exists(name):
+                continue
+            print(f"dangling {kind}: {name}")
+            counts["dangling"] += 1
+            if not remove_dangling:
+                continue
+            if kind == "preview":
+                File.query.filter_by(preview=name).update({"preview": None, "preview_status": FilePreviewStatus.pending})
+                continue
+            column = File.blob_sha256 if kind == "blob" else File.filename
+            for file in File.query.filter(column == name).all():
+                db.session.delete(file)
+            if kind == "blob":
+                Blob.query.filter_by(sha256=name).delete()
+        dangling.clear()
+
+    # merge join of two name-sorted streams; neither side is held in memory
+    row = next(expected, None)
+    entry = next(stored, None)
+    last_name = ""
+    while row is not None or entry is not None:
+        counts["checked"] += 1
+        if entry is not None and entry[0] < last_name:
+            unordered.append(entry)
+            entry = next(stored, None)
+            if len(unordered) >= batch_size:
+                resolve_unordered()
+            continue
+        if entry is None or (row is not None and row.name < entry[0]):
+            dangling.append((row.name, row.kind))
+            row = next(expected, None)
+            if len(dangling) >= batch_size:
+                resolve_dangling()
+        elif row is None or entry[0] < row.name:
+            if entry[1] < cutoff:
+                orphans.append(entry[0])
+                if len(orphans) >= batch_size:
+                    flush_orphans()
+            last_name = entry[0]
+            entry = next(stored, None)
+        else:
+            last_name = entry[0]
+            row = next(expected, None)
+            entry = next(stored, None)
+
+    resolve_unordered()
+    resolve_dangling()
     db.session.commit()
-    print(f"{count_imported} people imported, {count_skipped} skipped")
+
+    print(f"{counts['checked']} names checked, {counts['orphans']} orphaned files, {counts['dangling']} dangling rows")
+
+@cli.command("mail-worker")
+@click.option("--once", is_flag=True, help="Send what is due and exit instead of polling.")
+@click.option("--interval", default=None, type=int, help="Seconds between polls (defaults to MAIL_WORKER_INTERVAL).")
+def mail_worker(once, interval):
+    from flask import current_app
+    from app.mail.outbox import process_outbox, run_outbox_worker
+
+    if once:
+        sent, failed = process_outbox()
+        print(f"{sent} messages sent, {failed} failed")
+        return
+    run_outbox_worker(interval or current_app.config["MAIL_WORKER_INTERVAL"])
+
+@cli.command("send-digest")
+@click.argument("frequency", type=click.Choice(["daily", "weekly"]))
+@click.option("--dry-run", is_flag=True, help="Only report how many digests and messages would be queued.")
+def send_digest(frequency, dry_run):
+    from flask import current_app
+    from app.models import DigestFrequency
+    from app.mail.digest import send_digests
+
+    # digests link back to the site, so build URLs against SITE_URL
+    with current_app.test_request_context(base_url=current_app.config["SITE_URL"]):
+        stats = send_digests(DigestFrequency[frequency], dry_run=dry_run)
+    prefix = "Would queue" if dry_run else "Queued"
+    print(f"{prefix} {stats['messages']} messages for {stats['recipients']} of {stats['subscriptions']} due subscribers")
+    print(f"{stats['groups']} distinct tag sets, {stats['empty_groups']} without new posts, {stats['posts']} post entries rendered")
+
+EXPORT_VIEWS = {"users": "user", "people": "person", "posts": "post", "tags": "tag", "files": "file"}
+
+@cli.command("export")
+@click.argument("view", type=click.Choice(list(EXPORT_VIEWS)))
+@click.option("--format", "export_type", type=click.Choice(["csv", "jsonl", "json", "xlsx"]), default="csv", show_default=True)
+@click.option("--output", default=None, help="File to write (defaults to the admin export file name, - for stdout).")
+def export(view, export_type, output):
+    import sys
+    from flask import current_app
+    from app.extensions import admin
+    from app.admin.exports import write_export
+
+    model_view = next(v for v in admin._views if getattr(v, "endpoint", None) == EXPORT_VIEWS[view])
+    # the same columns and formatters as the admin export; formatters may build URLs, so give them a request
+    with current_app.test_request_context(base_url=current_app.config["SITE_URL"]):
+        output = output or model_view.get_export_name(export_type)
+        target = sys.stdout.buffer if output == "-" else open(output, "wb")
+        try:
+            for chunk in write_export(model_view, model_view.get_export_query(), export_type):
+                target.write(chunk.encode() if isinstance(chunk, str) else chunk)
+        finally:
+            if target is not sys.stdout.buffer:
+                target.close()
+    if output != "-":
+        print(f"Exported {view} to {output}")
 
 if __name__ == "__main__":
     cli()
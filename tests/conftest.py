@@ -0,0 +1,42 @@
+import os
+import sys
+import shutil
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP = tempfile.mkdtemp(prefix="itos-tests-")
+
+# config.py reads the environment when it is imported, so this has to happen before the app is
+os.environ["SECRET_KEY"] = "tests"
+os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{TMP}/itos.sqlite"
+os.environ["UPLOAD_FOLDER"] = os.path.join(TMP, "uploads")
+os.environ["PREVIEW_WORKERS"] = "0"
+sys.path.insert(0, ROOT)
+
+from config import Config
+from app import create_app
+from app.extensions import db
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+
+# flask-admin keeps its views on a module-level object, so the app can only be created once per process.
+# No app context stays pushed while tests run: requests would share it, and with it flask-login's user in g.
+@pytest.fixture(scope="session")
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+    yield app
+    shutil.rmtree(TMP, ignore_errors=True)
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def login_as(client, user_id):
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
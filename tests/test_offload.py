@@ -0,0 +1,113 @@
+import os
+import pytest
+from urllib.parse import quote
+
+from app.extensions import db
+from app.models import User, File, FileStatus, FilePreviewStatus, UserRole
+from app.storage import get_storage, preview_key
+
+from conftest import login_as
+
+OFFLOAD_HEADERS = ("X-Accel-Redirect", "X-Sendfile")
+
+def store(name, data):
+    path = os.path.join(get_storage().root, f".{name}.tmp")
+    with open(path, "wb") as f:
+        f.write(data)
+    get_storage().save(name, path)
+
+@pytest.fixture(scope="module")
+def users(app):
+    owner = User(email="owner@example.com", first_name="Jan", last_name="Kowalski", ldap_group="1a", password_hash="x", email_confirmed=True)
+    other = User(email="other@example.com", first_name="Anna", last_name="Nowak", ldap_group="1b", password_hash="x", email_confirmed=True)
+    admin = User(email="admin@example.com", first_name="Ewa", last_name="Admin", ldap_group="n", password_hash="x", email_confirmed=True, role=UserRole.admin)
+    with app.app_context():
+        db.session.add_all([owner, other, admin])
+        db.session.commit()
+        return {"owner": owner.id, "other": other.id, "admin": admin.id}
+
+@pytest.fixture(scope="module")
+def files(app, users):
+    files = {}
+    with app.app_context():
+        for status in FileStatus:
+            filename = f"{status.name}_plik.txt"
+            store(filename, status.name.encode())
+            store(preview_key(filename), b"RIFF")
+            db.session.add(File(
+                name=f"plik {status.name}", filename=filename, user_id=users["owner"], mimetype="text/plain",
+                size=len(status.name), status=status, preview=preview_key(filename), preview_status=FilePreviewStatus.ready,
+            ))
+            files[status] = filename
+        db.session.commit()
+    return files
+
+@pytest.fixture(params=["x-accel-redirect", "x-sendfile"])
+def offload_mode(app, request):
+    app.config["FILE_OFFLOAD_MODE"] = request.param
+    yield request.param
+    app.config["FILE_OFFLOAD_MODE"] = "direct"
+
+def request_as(client, users, viewer, url):
+    if viewer != "anonymous":
+        login_as(client, users[viewer])
+    return client.get(url)
+
+def expected_header(app, mode, name):
+    storage = app.extensions["itos_storage"]
+    if mode == "x-accel-redirect":
+        return app.config["FILE_OFFLOAD_PREFIX"].rstrip("/") + "/" + quote(storage.relative_path(name))
+    return storage.local_path(name)
+
+@pytest.mark.parametrize("viewer", ["anonymous", "owner", "other", "admin"])
+def test_visible_file_is_offloaded(app, client, users, files, offload_mode, viewer):
+    filename = files[FileStatus.visible]
+    resp = request_as(client, users, viewer, f"/uploads/{filename}")
+    assert resp.status_code == 200
+    assert resp.data == b""
+    header = "X-Accel-Redirect" if offload_mode == "x-accel-redirect" else "X-Sendfile"
+    assert resp.headers[header] == expected_header(app, offload_mode, filename)
+    assert resp.headers["Content-Type"].startswith("text/plain")
+    assert resp.headers["ETag"]
+    assert "public" in resp.headers["Cache-Control"]
+
+@pytest.mark.parametrize("status", [FileStatus.hidden, FileStatus.pending])
+@pytest.mark.parametrize("viewer", ["anonymous", "owner", "other"])
+def test_blocked_file_is_not_offloaded(client, users, files, offload_mode, viewer, status):
+    resp = request_as(client, users, viewer, f"/uploads/{files[status]}")
+    assert resp.status_code == 403
+    for header in OFFLOAD_HEADERS:
+        assert header not in resp.headers
+
+@pytest.mark.parametrize("status", [FileStatus.hidden, FileStatus.pending])
+def test_admin_gets_blocked_file_privately(app, client, users, files, offload_mode, status):
+    filename = files[status]
+    resp = request_as(client, users, "admin", f"/uploads/{filename}")
+    assert resp.status_code == 200
+    header = "X-Accel-Redirect" if offload_mode == "x-accel-redirect" else "X-Sendfile"
+    assert resp.headers[header] == expected_header(app, offload_mode, filename)
+    assert "private" in resp.headers["Cache-Control"]
+    assert "public" not in resp.headers["Cache-Control"]
+
+@pytest.mark.parametrize("status", [FileStatus.hidden, FileStatus.pending])
+@pytest.mark.parametrize("viewer", ["anonymous", "owner", "other"])
+def test_blocked_preview_is_not_offloaded(client, users, files, offload_mode, viewer, status):
+    resp = request_as(client, users, viewer, f"/uploads/{files[status]}/preview")
+    assert resp.status_code == 404
+    for header in OFFLOAD_HEADERS:
+        assert header not in resp.headers
+
+@pytest.mark.parametrize("viewer", ["anonymous", "admin"])
+def test_preview_is_offloaded(app, client, users, files, offload_mode, viewer):
+    filename = files[FileStatus.visible]
+    resp = request_as(client, users, viewer, f"/uploads/{filename}/preview")
+    assert resp.status_code == 200
+    header = "X-Accel-Redirect" if offload_mode == "x-accel-redirect" else "X-Sendfile"
+    assert resp.headers[header] == expected_header(app, offload_mode, preview_key(filename))
+    assert resp.headers["Content-Type"] == "image/webp"
+
+def test_unknown_file_is_not_offloaded(client, offload_mode):
+    resp = client.get("/uploads/nie-ma-takiego-pliku.txt")
+    assert resp.status_code == 404
+    for header in OFFLOAD_HEADERS:
+        assert header not in resp.headers
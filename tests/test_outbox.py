@@ -0,0 +1,162 @@
+import socketserver
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+
+from app.extensions import db, mail
+from app.models import OutboxMessage, OutboxStatus
+
+# app.mail is imported lazily: importing the package before create_app() runs would shadow the
+# Flask-Mail object that app/__init__.py imports under the same name
+def process_outbox():
+    from app.mail.outbox import process_outbox
+
+    return process_outbox()
+
+# Just enough of an SMTP server for smtplib: answers for `rejected` recipients come at the end of DATA,
+# the way a content filter or a size limit refuses a message after the recipients were accepted.
+class StandInSMTP(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.received = []
+        self.rejected = {}
+        self.drop_after = None
+
+class StandInHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        self.reply("220 stand-in")
+        recipients = []
+        data = None
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode().rstrip("\r\n")
+            if data is not None:
+                if line != ".":
+                    data.append(line)
+                    continue
+                data = None
+                answer = next((server.rejected[r] for r in recipients if r in server.rejected), None)
+                if answer:
+                    self.reply(answer)
+                elif server.drop_after is not None and len(server.received) >= server.drop_after:
+                    return
+                else:
+                    server.received.append(list(recipients))
+                    self.reply("250 ok")
+                recipients = []
+                continue
+            command = line.split(" ", 1)[0].upper()
+            if command == "RCPT":
+                recipients.append(line.split("<", 1)[1].rstrip(">"))
+                self.reply("250 ok")
+            elif command == "DATA":
+                data = []
+                self.reply("354 go ahead")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            elif command == "RSET":
+                recipients = []
+                self.reply("250 ok")
+            else:
+                self.reply("250 ok")
+
+@pytest.fixture
+def smtp(app):
+    server = StandInSMTP()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    saved = {key: app.config[key] for key in ("MAIL_SERVER", "MAIL_PORT", "MAIL_USE_TLS", "MAIL_MAX_EMAILS", "MAIL_SEND_PAUSE")}
+    app.config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=server.server_address[1], MAIL_USE_TLS=False, MAIL_MAX_EMAILS=2, MAIL_SEND_PAUSE=0, MAIL_SUPPRESS_SEND=False)
+    mail.init_app(app)
+    with app.app_context():
+        db.session.query(OutboxMessage).delete()
+        db.session.commit()
+        yield server
+        db.session.query(OutboxMessage).delete()
+        db.session.commit()
+    server.shutdown()
+    server.server_close()
+    app.config.update(saved, MAIL_SUPPRESS_SEND=True)
+    mail.init_app(app)
+
+def queue(*recipients):
+    for recipient in recipients:
+        db.session.add(OutboxMessage(subject=f"do {recipient}", body="treść", recipients=[recipient]))
+    db.session.commit()
+
+# stands in for the retry delay passing between worker runs
+def run_until_idle(runs=10):
+    for _ in range(runs):
+        db.session.execute(db.update(OutboxMessage).where(OutboxMessage.status == OutboxStatus.pending).values(next_attempt_at=datetime.utcnow()))
+        db.session.commit()
+        process_outbox()
+
+def states():
+    db.session.expire_all()
+    return {m.recipients[0]: (m.status, m.attempts) for m in OutboxMessage.query.order_by(OutboxMessage.id)}
+
+def test_rejected_data_only_fails_that_message(smtp):
+    smtp.rejected["bad@example.com"] = "550 nope"
+    queue("bad@example.com", "a@example.com", "b@example.com", "c@example.com", "d@example.com")
+    run_until_idle()
+    assert states() == {
+        "bad@example.com": (OutboxStatus.dead, 1),
+        "a@example.com": (OutboxStatus.sent, 0),
+        "b@example.com": (OutboxStatus.sent, 0),
+        "c@example.com": (OutboxStatus.sent, 0),
+        "d@example.com": (OutboxStatus.sent, 0),
+    }
+    assert OutboxMessage.query.filter_by(status=OutboxStatus.dead).one().last_error == "SMTPDataError: (550, b'nope')"
+    assert len(smtp.received) == 4
+
+def test_temporary_rejection_retries_only_that_message(app, smtp):
+    smtp.rejected["busy@example.com"] = "451 try later"
+    queue("a@example.com", "busy@example.com", "b@example.com")
+    process_outbox()
+    assert states() == {
+        "a@example.com": (OutboxStatus.sent, 0),
+        "busy@example.com": (OutboxStatus.pending, 1),
+        "b@example.com": (OutboxStatus.sent, 0),
+    }
+    del smtp.rejected["busy@example.com"]
+    run_until_idle(1)
+    assert states()["busy@example.com"] == (OutboxStatus.sent, 1)
+
+def test_dropped_connection_charges_only_the_message_in_flight(smtp):
+    smtp.drop_after = 1
+    queue("a@example.com", "b@example.com", "c@example.com")
+    sent, failed = process_outbox()
+    assert (sent, failed) == (1, 2)
+    assert states() == {
+        "a@example.com": (OutboxStatus.sent, 0),
+        "b@example.com": (OutboxStatus.pending, 1),
+        "c@example.com": (OutboxStatus.pending, 0),
+    }
+    c = OutboxMessage.query.filter(OutboxMessage.recipients.contains("c@example.com")).one()
+    assert c.next_attempt_at > datetime.utcnow()
+
+def test_paused_batch_keeps_its_lease(app, smtp, monkeypatch):
+    import app.mail.outbox as outbox
+
+    monkeypatch.setitem(app.config, "MAIL_OUTBOX_LEASE", 1)
+    monkeypatch.setitem(app.config, "MAIL_SEND_PAUSE", 2)
+    claimable = []
+    # instead of sleeping, check whether another worker could claim the rest of the batch once the pause is over
+    def pause(seconds):
+        later = datetime.utcnow() + timedelta(seconds=seconds)
+        claimable.append(OutboxMessage.query.filter(OutboxMessage.status == OutboxStatus.pending, OutboxMessage.next_attempt_at <= later).count())
+    monkeypatch.setattr(outbox, "time", SimpleNamespace(sleep=pause))
+    queue("a@example.com", "b@example.com", "c@example.com")
+    assert process_outbox() == (3, 0)
+    assert claimable == [0, 0]